@@ -7,6 +7,8 @@
 import pygame
 from pygame.locals import (QUIT, KEYDOWN, KEYUP)
 import numpy as np
+import time
+from clock import SimClock
 
 
 class Keys():
@@ -19,6 +21,31 @@ for key in keys:
 #print(keys)
 
 
+POLYGON, EDGE, CIRCLE = range(3)
+
+class DrawQueue():
+	# Primitives of a frame, kept in the order they are drawn. Vertices are
+	# either in world coordinates (points) or in the local coordinates of a
+	# body (blocks, each with the pose of its body)
+
+	def __init__(self):
+		self.commands = []
+		self.points = []
+		self.blocks = []
+		self.poses = []
+		self.n_local = 0
+
+	def add(self, kind, vertices, color, radius = 0):
+		self.commands.append((kind, False, len(self.points), len(vertices), color, radius))
+		self.points.extend((v[0], v[1]) for v in vertices)
+
+	def add_local(self, vertices, pose, color):
+		self.commands.append((POLYGON, True, self.n_local, len(vertices), color, 0))
+		self.blocks.append(vertices)
+		self.poses.append(pose)
+		self.n_local += len(vertices)
+
+
 class Framework():
 
 	TARGET_FPS = 60
@@ -35,9 +62,18 @@ class Framework():
 	description = ''
 	
 	world = None
-	start_time = None
-	time = None
+	clock = None
+	time = 0.0
 	fps = 0.0
+	# sim seconds per wall second, None: as fast as possible
+	real_time_factor = 1.0
+	# texts drawn during the steps, shown with the frame
+	text_buffer = None
+	# static bodies, drawn once off-screen
+	background = None
+	background_key = None
+	# dynamic bodies, queued and drawn at once
+	draw_queue = None
 
 	def __init__( self, name, world, description = ''):
 		self.name = name
@@ -62,14 +98,16 @@ class Framework():
 		
 		
 	def run( self):
-		if not self.running: self.start_time = pygame.time.get_ticks()
+		# sim time (self.time) is advanced by fixed steps, decoupled from the
+		# frame rate: several steps per frame when real_time_factor > 1
+		if not self.running:
+			self.clock = SimClock(self.TIMESTEP, self.real_time_factor, 1.0 / self.TARGET_FPS)
 
 		self.running = True
 		clock = pygame.time.Clock()
+		step_texts = []
 		
 		while self.running:
-			self.time = (pygame.time.get_ticks() - self.start_time) * 0.001
-
 			# Check for keyboard events
 			for event in pygame.event.get():
 				if event.type == QUIT or (event.type == KEYDOWN and event.key == Keys.K_ESCAPE):
@@ -78,30 +116,66 @@ class Framework():
 					self.Keyboard(event.key)
 				elif event.type == KEYUP:
 					self.KeyboardUp(event.key)
+
+			# Run the world, step by step...
+			# (only the texts of the last step of the frame are shown)
+			self.clock.real_time_factor = self.real_time_factor
+			self.clock.begin_frame()
+			while self.running and self.world and self.clock.step_due():
+				self.text_buffer = []
+				self.time = self.clock.time
+				self.world.step(self)
+				self.clock.tick()
+				step_texts = self.text_buffer
+			self.text_buffer = None
+			self.clock.end_frame()
+			profiler = self.world.profiler if self.world else None
 					
-			# Initialise drawing surface
-			self.screen.fill((0, 0, 0))
+			# Initialise drawing surface, with the static bodies
+			draw_start = time.perf_counter()
+			self.DrawBackground()
 			self.textLine = 15
 
 			# Draw the name
 			self.DrawText(self.name, (127, 127, 255))
 			#self.DrawText(str(self.fps), (127, 127, 255))
+			self.DrawText(self.time_info(), (127, 127, 255))
 
 			# Draw a description
 			if self.description:
 				for s in self.description.split('\n'):
 					self.DrawText(s, (127, 255, 127))
-					
-			# Run the world, step by step...
+
+			for text in step_texts:
+				self.DrawText(*text)
+
 			if self.world:
-				self.world.step(self)
-				self.world.draw(self)
+				self.BeginDraw()
+				self.world.draw(self, static=False)
+				self.EndDraw()
+
+			# Per-phase timings, if the world is profiled
+			if profiler is not None:
+				profiler.add('draw', time.perf_counter() - draw_start)
+				profiler.draw(self)
 				
 			# Updating drawing surface
+			flip_start = time.perf_counter()
 			pygame.display.flip()
-			clock.tick(self.TARGET_FPS)
+			tick_start = time.perf_counter()
+			if self.real_time_factor is None:
+				clock.tick()
+			else:
+				clock.tick(self.TARGET_FPS)
 			self.fps = clock.get_fps()
 
+			if profiler is not None:
+				profiler.add('flip', tick_start - flip_start)
+				profiler.add('tick', time.perf_counter() - tick_start)
+				profiler.end_frame()
+
+		if self.world and self.world.profiler is not None and self.world.profiler.path:
+			self.world.profiler.dump()
 					
 		# Destroy the world...
 		if self.world:
@@ -110,36 +184,203 @@ class Framework():
 			self.world.renderer = None
 
 			
+	def time_info(self):
+		target = 'max' if self.real_time_factor is None else 'x%g' % self.real_time_factor
+		return 'time: %.1f s, speed: %s (x%.1f), fps: %.0f' % (self.time, target, self.clock.achieved_factor(), self.fps)
+
 			
 	# Keyboard events
 	def Keyboard(self, key):
 		self.pressed_keys.add(key)
 
+		# +/- : faster/slower, 0 : as fast as possible, 1 : real time
+		if key in (Keys.K_PLUS, Keys.K_KP_PLUS, Keys.K_EQUALS) and self.real_time_factor is not None:
+			self.real_time_factor *= 2
+		elif key in (Keys.K_MINUS, Keys.K_KP_MINUS):
+			self.real_time_factor = 32.0 if self.real_time_factor is None else max(self.real_time_factor / 2, 1/16)
+		elif key in (Keys.K_0, Keys.K_KP0):
+			self.real_time_factor = None
+		elif key in (Keys.K_1, Keys.K_KP1):
+			self.real_time_factor = 1.0
+
 	def KeyboardUp(self, key):
 		self.pressed_keys.remove(key)
 		
 	# Drawing primitives
 	def DrawText(self, str, color=(229, 153, 153, 255)):
+		if self.text_buffer is not None:
+			self.text_buffer.append((str, color))
+			return
 		self.screen.blit(self.font.render( str, True, color), (5, self.textLine))
 		self.textLine += 15
 		
+	def DrawBackground(self):
+		# clears the screen with the static bodies of the world, rasterized
+		# again only when the view or the static bodies change
+		static_bodies = [body for body in self.world.bodies if getattr(body, 'is_static', False)] if self.world else []
+		key = (self.PPM, self.SCREEN_OFFSETX, self.SCREEN_OFFSETY, self.screen.get_size(),
+				tuple(id(body) for body in static_bodies))
+
+		if key != self.background_key:
+			self.background = pygame.Surface(self.screen.get_size())
+			self.background.fill((0, 0, 0))
+			screen, self.screen = self.screen, self.background
+			for body in static_bodies:
+				body.draw(self)
+			self.screen = screen
+			self.background_key = key
+
+		self.screen.blit(self.background, (0, 0))
+
+	def InvalidateBackground(self):
+		# to be called if static geometry is changed in place
+		self.background_key = None
+
+	def BeginDraw(self):
+		# until EndDraw, the primitives are queued instead of drawn
+		self.draw_queue = DrawQueue()
+
+	def EndDraw(self):
+		# all the queued vertices are transformed to the screen at once, then
+		# the primitives are drawn in the order they were queued
+		queue, self.draw_queue = self.draw_queue, None
+		if queue is None or not queue.commands:
+			return
+
+		points = self.to_screen(np.array(queue.points, dtype=float).reshape(-1, 2))
+		local = []
+		if queue.blocks:
+			vertices = np.concatenate(queue.blocks)
+			poses = np.repeat(np.array(queue.poses), [len(b) for b in queue.blocks], axis=0)
+			local = self.to_screen(self.to_world(vertices, poses))
+
+		for kind, is_local, start, n, color, radius in queue.commands:
+			vertices = (local if is_local else points)[start:start + n]
+			if kind == POLYGON:
+				pygame.draw.polygon(self.screen, color, vertices, 1)
+			elif kind == EDGE:
+				pygame.draw.line(self.screen, color, vertices[0], vertices[1])
+			else:
+				pygame.draw.circle(self.screen, color, vertices[0], int(radius * self.PPM))
+
+	def to_world(self, vertices, poses):
+		# vertices in body coordinates, poses (x, y, angle) of their bodies
+		c, s = np.cos(poses[:, 2]), np.sin(poses[:, 2])
+		return np.column_stack((poses[:, 0] + c * vertices[:, 0] - s * vertices[:, 1],
+								poses[:, 1] + s * vertices[:, 0] + c * vertices[:, 1]))
+
+	def to_screen(self, vertices):
+		# as fix_vertices, for an array of vertices in world coordinates
+		x = (self.SCREEN_OFFSETX + vertices[:, 0] * self.PPM).astype(int)
+		y = (self.SCREEN_OFFSETY - vertices[:, 1] * self.PPM).astype(int)
+		return np.column_stack((x, y)).tolist()
+
 	def fix_vertices(self, vertices):
 		return [(int(self.SCREEN_OFFSETX + v[0]), int(self.SCREEN_OFFSETY - v[1])) for v in vertices]
 
 	def DrawPolygon(self, vertices, color):
+		if self.draw_queue is not None:
+			self.draw_queue.add(POLYGON, vertices, color)
+			return
 		vertices = self.fix_vertices([np.array(v) * self.PPM for v in vertices])
 		pygame.draw.polygon(self.screen, color, vertices, 1)
 
+	def DrawBodyPolygon(self, b2body, vertices, color):
+		# vertices: array of the polygon vertices, in the coordinates of b2body
+		pose = (b2body.position[0], b2body.position[1], b2body.angle)
+		if self.draw_queue is not None:
+			self.draw_queue.add_local(vertices, pose, color)
+			return
+		vertices = self.to_screen(self.to_world(np.asarray(vertices, dtype=float), np.array([pose])))
+		pygame.draw.polygon(self.screen, color, vertices, 1)
+
 	def DrawCircle(self, position, radius, color):
+		if self.draw_queue is not None:
+			self.draw_queue.add(CIRCLE, (position,), color, radius)
+			return
 		position = self.fix_vertices([np.array(position) * self.PPM])[0]
 		pygame.draw.circle(self.screen, color, position, int(radius * self.PPM))
 
 	def DrawEdge(self, vertex1, vertex2, color):
+		if self.draw_queue is not None:
+			self.draw_queue.add(EDGE, (vertex1, vertex2), color)
+			return
 		vertices = self.fix_vertices([np.array(vertex1) * self.PPM, np.array(vertex2) * self.PPM])
 		pygame.draw.line(self.screen, color, vertices[0], vertices[1])
 
 
+class HeadlessFramework(Framework):
+	# Steps the world back-to-back, without window, event loop or frame rate
+	# limit. Drawing primitives are no-ops, keys and time are synthetic, so
+	# the same vehicles and controllers can be run as fast as the CPU allows.
 
+	steps = 0
+	sps = 0.0
 
+	def __init__( self, name, world, description = ''):
+		self.name = name
+		self.description = description
+
+		# Keep track of the pressed keys (to be filled by the caller, if needed)
+		self.pressed_keys = set()
+
+		# Link the framework to a world
+		self.world = world
+		self.steps = 0
+		self.time = 0.0
+
+
+	def run( self, steps = None, duration = None, draw = False, verbose = True):
+		# steps: number of steps to run, duration: simulated seconds to run,
+		# if both are None the loop runs until self.running is set to False
+		if duration is not None:
+			steps = int(round(duration / self.TIMESTEP))
+
+		self.running = True
+		start_steps = self.steps
+		start = time.perf_counter()
+
+		while self.running and (steps is None or self.steps - start_steps < steps):
+			self.time = self.steps * self.TIMESTEP
+			self.textLine = 15
+
+			if self.world:
+				self.world.step(self)
+				if draw:
+					self.world.draw(self)
 
+			self.steps += 1
+
+		elapsed = time.perf_counter() - start
+		n_steps = self.steps - start_steps
+		self.sps = n_steps / elapsed if elapsed > 0 else float('inf')
+		self.running = False
+
+		if verbose:
+			print('%s: %d steps in %.3f s, %.1f steps/s (%.1fx real time)'
+					% (self.name, n_steps, elapsed, self.sps, self.sps / self.TARGET_FPS))
+
+		if self.world and self.world.profiler is not None and self.world.profiler.path:
+			self.world.profiler.dump()
+
+		return self.sps
+
+
+	# Drawing primitives
+	def DrawText(self, str, color=(229, 153, 153, 255)):
+		pass
+
+	def DrawPolygon(self, vertices, color):
+		pass
+
+	def DrawBodyPolygon(self, b2body, vertices, color):
+		pass
+
+	def DrawCircle(self, position, radius, color):
+		pass
+
+	def DrawEdge(self, vertex1, vertex2, color):
+		pass
 
+	def DrawBackground(self):
+		pass
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+import time
+
+"""
+Simulated time, advanced by fixed steps and decoupled from wall time.
+
+At each frame, the wall time elapsed since the previous frame, multiplied by
+the real time factor, is added to an accumulator; steps are run while the
+accumulator holds a whole timestep. The physics always advances by the same
+timestep, whatever the frame rate. When the steps of a frame take more than
+the frame budget, the backlog is dropped: the simulation runs slower than
+the target, and the achieved factor reports it.
+
+real_time_factor: 1.0 for real time, 10.0 for ten times faster, None to run
+as many steps as the frame budget allows.
+"""
+
+class SimClock():
+
+	def __init__(self, timestep, real_time_factor = 1.0, frame_budget = None):
+		self.timestep = timestep
+		self.real_time_factor = real_time_factor
+		self.frame_budget = frame_budget
+
+		self.time = 0.0
+		self.n_steps = 0
+		self.accumulator = 0.0
+		self.frame_steps = 0
+
+		self.last_wall = None
+		self.frame_start = None
+		# (wall time, sim time) at the end of the recent frames
+		self.history = []
+		self.window = 1.0
+
+	def begin_frame(self):
+		now = time.perf_counter()
+		if self.last_wall is None:
+			self.last_wall = now
+			self.history = [(now, self.time)]
+
+		if self.real_time_factor is None:
+			self.accumulator = float('inf')
+		else:
+			self.accumulator += (now - self.last_wall) * self.real_time_factor
+
+		self.last_wall = now
+		self.frame_start = now
+		self.frame_steps = 0
+
+	def step_due(self):
+		if self.accumulator < self.timestep:
+			return False
+		# at least one step per frame, then only within the frame budget
+		if self.frame_steps > 0 and self.frame_budget is not None:
+			return time.perf_counter() - self.frame_start < self.frame_budget
+		return True
+
+	def tick(self):
+		self.n_steps += 1
+		self.time = self.n_steps * self.timestep
+		self.accumulator -= self.timestep
+		self.frame_steps += 1
+
+	def end_frame(self):
+		# drop the steps that did not fit in the frame
+		if self.real_time_factor is None or self.accumulator >= self.timestep:
+			self.accumulator = 0.0
+
+		now = time.perf_counter()
+		self.history.append((now, self.time))
+		while len(self.history) > 2 and now - self.history[1][0] > self.window:
+			self.history.pop(0)
+
+	def achieved_factor(self):
+		# simulated seconds per wall second, over the last second
+		if len(self.history) < 2:
+			return 0.0
+		(wall_0, sim_0), (wall_1, sim_1) = self.history[0], self.history[-1]
+		if wall_1 <= wall_0:
+			return 0.0
+		return (sim_1 - sim_0) / (wall_1 - wall_0)
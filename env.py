@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from IO import Framework, HeadlessFramework
+import pygame
+import numpy as np
+import random
+
+"""
+Gym-style environment around a World and its Rover, to drive the simulator
+from an external loop instead of a Vehicle.step controller.
+
+make_world(seed) returns (world, rover); the rover should not drive its own
+tires (a plain platforms.Rover). Actions are the (linear, angular) speeds of
+ex_5.py, observations are float32 views of a single preallocated buffer,
+overwritten in place at each step: copy them to keep them.
+
+The world is built on the first reset, and again when reset is given a new
+seed; otherwise reset restores the snapshot taken when it was built.
+
+Observation: laser | ir (front, then rear) | gripper angle | pose (x, y, angle)
+"""
+
+class RoverEnv():
+
+	def __init__(self, make_world, seed = None, reward = None, done = None, max_steps = None, render = False):
+		self.make_world = make_world
+		self.seed = seed
+		self.reward_fn = reward
+		self.done_fn = done
+		self.max_steps = max_steps
+		self.rendering = render
+
+		self.world = None
+		self.rover = None
+		self.initial_state = None
+		self.built_seed = None
+		self.fw = None
+		self.screen = None
+		self.observation = None
+		self.info = {}
+
+
+	def observation_size(self):
+		n_laser = len(self.rover.laserscan.values)
+		n_ir = len(self.rover.front_ir.values) + len(self.rover.rear_ir.values)
+		return n_laser + n_ir + 1 + 3
+
+	def allocate(self):
+		n_laser = len(self.rover.laserscan.values)
+		n_ir = len(self.rover.front_ir.values) + len(self.rover.rear_ir.values)
+
+		self.observation = np.zeros(self.observation_size(), dtype=np.float32)
+		self.laser = self.observation[:n_laser]
+		self.ir = self.observation[n_laser:n_laser + n_ir]
+		self.front_ir = self.ir[:len(self.rover.front_ir.values)]
+		self.rear_ir = self.ir[len(self.rover.front_ir.values):]
+		self.gripper = self.observation[n_laser + n_ir:n_laser + n_ir + 1]
+		self.pose = self.observation[-3:]
+
+
+	def observe(self):
+		rover = self.rover
+		self.laser[:] = rover.laserscan.values
+		self.front_ir[:] = rover.front_ir.values
+		self.rear_ir[:] = rover.rear_ir.values
+		self.gripper[0] = rover.gripper.get_angle()
+		position = rover.b2body.position
+		self.pose[:] = (position[0], position[1], rover.b2body.angle)
+
+
+	def reset(self, seed = None):
+		if seed is not None:
+			self.seed = seed
+		if self.seed is not None:
+			random.seed(self.seed)
+			np.random.seed(self.seed)
+
+		if self.world is None or self.seed != self.built_seed:
+			self.world, self.rover = self.make_world(self.seed)
+			self.fw = HeadlessFramework('env', self.world)
+
+			# first readings, without stepping the physics
+			for scan in (self.rover.laserscan, self.rover.front_ir, self.rover.rear_ir):
+				scan.step(self.fw)
+			self.initial_state = self.world.snapshot()
+			self.built_seed = self.seed
+		else:
+			self.world.restore(self.initial_state)
+			self.fw.steps = 0
+		self.fw.time = 0.0
+
+		# the same buffer is reused from one episode to the next
+		if self.observation is None or len(self.observation) != self.observation_size():
+			self.allocate()
+		self.observe()
+		if self.rendering:
+			self.render()
+		return self.observation
+
+
+	def step(self, action):
+		# action: (linear, angular) speeds, converted to the speeds of the two
+		# wheels as in ex_5.py
+		v_l = action[0] - action[1]/2
+		v_r = action[0] + action[1]/2
+		self.rover.tires[0].update_drive( v_l ) # left wheel
+		self.rover.tires[1].update_drive( v_r ) # right wheel
+
+		fw = self.fw
+		fw.time = fw.steps * fw.TIMESTEP
+		self.world.step(fw)
+		fw.steps += 1
+		self.observe()
+
+		reward = self.reward_fn(self) if self.reward_fn else 0.0
+		done = bool(self.done_fn(self)) if self.done_fn else False
+		truncated = self.max_steps is not None and fw.steps >= self.max_steps
+		self.info['time'] = fw.steps * fw.TIMESTEP
+		self.info['truncated'] = truncated
+
+		if self.rendering:
+			self.render()
+		return self.observation, reward, done or truncated, self.info
+
+
+	def render(self):
+		# opens the pygame window on the first call, then draws one frame
+		if self.screen is None:
+			self.screen = Framework('RoverEnv', self.world)
+		screen = self.screen
+		screen.world = self.world
+		screen.DrawBackground()
+		screen.textLine = 15
+		screen.DrawText(screen.name, (127, 127, 255))
+		screen.BeginDraw()
+		self.world.draw(screen, static=False)
+		screen.EndDraw()
+		pygame.event.pump()
+		pygame.display.flip()
+
+
+
+# Example: random actions in the empty arena
+def make_arena(seed):
+	from world import World, Wall
+	from platforms import Rover
+
+	world = World()
+	world.bodies.append( Wall( world) )
+	rover = Rover( world, position=(0, 0))
+	world.bodies.append( rover )
+	return world, rover
+
+
+if __name__ == "__main__":
+	import time
+
+	env = RoverEnv(make_arena, seed=0, max_steps=1000)
+	observation = env.reset()
+	done = False
+	start = time.perf_counter()
+	while not done:
+		action = (5.0, 5 * np.random.randn())
+		observation, reward, done, info = env.step(action)
+	elapsed = time.perf_counter() - start
+
+	print('%d steps, %.1f steps/s' % (env.fw.steps, env.fw.steps / elapsed))
+	print('laser:', env.laser[:5], 'ir:', env.ir, 'gripper:', env.gripper, 'pose:', env.pose)
@@ -11,6 +11,14 @@ from platforms import *
 import numpy as np
 
 class MyRover( Rover):
+	# seuils (distances) et vitesses de rotation du contrôleur
+	far_distance = 20
+	near_distance = 6
+	turn_rate = 5
+	sharp_turn_rate = 10
+	# bruit de rotation en reculant
+	noise_turn_rate = 5
+
 	def __init__(self, world, **vehicle_kws):
 		super().__init__(world, **vehicle_kws)
 		
@@ -40,26 +48,26 @@ class MyRover( Rover):
 		
 		# obstacle à l'avant, gauche libre: tourner à gauche
 		if left > center:
-			motor_control = (+5, +5)
+			motor_control = (+5, +self.turn_rate)
 		# obstacle à l'avant, droite libre: tourner à droite
 		elif right > center:
-			motor_control = (+5, -5)
+			motor_control = (+5, -self.turn_rate)
 		# sinon, si l'obstacle est trop proche de nous, on recule
-		if max( left, center, right) < 20:
-			motor_control = (-10, 5*np.random.randn()) # on ajoute un peu de bruit pour tourner un peu
+		if max( left, center, right) < self.far_distance:
+			motor_control = (-10, self.noise_turn_rate*np.random.randn()) # on ajoute un peu de bruit pour tourner un peu
 
 		# on verifie aussi les capteurs de proximité
 		# capteurs à l'avant
-		if self.front_ir.values[0] < 6:
-			motor_control = (motor_control[0],-10)
-		if self.front_ir.values[2] < 6:
-			motor_control = (motor_control[0],+10)
+		if self.front_ir.values[0] < self.near_distance:
+			motor_control = (motor_control[0],-self.sharp_turn_rate)
+		if self.front_ir.values[2] < self.near_distance:
+			motor_control = (motor_control[0],+self.sharp_turn_rate)
 		# capteurs à l'arriere
-		if self.rear_ir.values[0] < 6:
-			motor_control = (motor_control[0],+10)
-		if self.rear_ir.values[2] < 6:
-			motor_control = (motor_control[0],-10)
-		if self.rear_ir.values[1] < 6:
+		if self.rear_ir.values[0] < self.near_distance:
+			motor_control = (motor_control[0],+self.sharp_turn_rate)
+		if self.rear_ir.values[2] < self.near_distance:
+			motor_control = (motor_control[0],-self.sharp_turn_rate)
+		if self.rear_ir.values[1] < self.near_distance:
 			motor_control = (10,0)
 		# ..on utilisera le capteur positionné au centre en avant du rover
 		# pour vérifier si on a quelque chose dans le gripper..
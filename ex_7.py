@@ -7,8 +7,8 @@
 from IO import Framework, Keys
 from world import World, Wall, Ball
 from platforms import *
+from laserscan import ScanHistory
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 
 class MyRover( KeyboardRover):
@@ -17,8 +17,9 @@ class MyRover( KeyboardRover):
 		
 		self.laser_angles = np.linspace(-np.pi/2,+np.pi/2,len(self.laserscan.values))
 		# on crée une memoire à court terme
-		self.laser_data = pd.DataFrame(columns = self.laser_angles)
 		self.max_laser_data = 30
+		self.laser_data = ScanHistory(self.laserscan, self.max_laser_data,
+										sectors = {'right': slice(0, 15), 'center': slice(15, 30), 'left': slice(30, None)})
 		
 		plt.ion()
 		
@@ -34,31 +35,26 @@ class MyRover( KeyboardRover):
 		super().step(fw)
 		
 		# on ajoute les nouvelles perceptions
-		self.laser_data.loc[fw.time] = self.laserscan.values
-		# on garde juste le N dernieres perceptions
-		if(len(self.laser_data) > self.max_laser_data):
-			self.laser_data.drop( self.laser_data.index[0], inplace=True)
+		# (la memoire garde juste le N dernieres perceptions)
+		self.laser_data.append()
 
-		right_data = self.laser_data[self.laser_angles[  :15]]
-		center_data = self.laser_data[self.laser_angles[15:30]]
-		left_data = self.laser_data[self.laser_angles[30:  ]]
-
-		right  = right_data.mean().mean()
-		center = center_data.mean().mean()
-		left   = left_data.mean().mean()
+		right  = self.laser_data.sector_mean('right')
+		center = self.laser_data.sector_mean('center')
+		left   = self.laser_data.sector_mean('left')
 				
 		# si le tableau est plein,
 		# on utilise les lectures laser pour vérifier la presence de la balle
 		ball_seen  = False
 		ball_model = None
-		if(len(self.laser_data) == self.max_laser_data):
-			ball_features = np.diff( center_data.median() ) > 2
+		if self.laser_data.full():
+			center_median = self.laser_data.median('center')
+			ball_features = np.diff( center_median ) > 2
 			ball_seen  = np.any(ball_features)
 			if ball_seen:
 				ball_lasers_idx = np.where( ball_features)
 				ball_idx = int(np.median(ball_lasers_idx))
 				ball_angle = self.laser_angles[15+ball_idx]
-				ball_dist = center_data.median()[ball_angle]
+				ball_dist = center_median[ball_idx]
 				ball_model = (ball_dist, ball_angle)
 
 		info_string = ''
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from IO import HeadlessFramework
+import multiprocessing as mp
+import traceback
+import pickle
+import sys
+import os
+
+"""
+Copy-on-write forks of a running world, for look-ahead planning.
+
+world.fork(rollout) forks the process (os.fork, Linux and macOS): the child
+gets a copy-on-write copy of the whole simulation, Box2D world included,
+runs rollout(world, fw) headless and sends its (picklable) return value
+back. Pages that are only read, like the static geometry of Wall and Maze
+bodies, stay shared with the parent; only the pages of the bodies that move
+are copied. The parent world is left untouched and goes on while the forks
+run, several forks run in parallel.
+
+	def steer_left(world, fw):
+		rover.tires[0].update_drive(-5)
+		rover.tires[1].update_drive(+5)
+		fw.run(duration=1.0, verbose=False)
+		return tuple(rover.b2body.position)
+
+	left = world.fork(steer_left)
+	...
+	position = left.result()
+
+Step hooks are not run in the forks, and the forks are not profiled:
+recorders and profilers belong to the parent.
+"""
+
+class WorldFork():
+
+	def __init__(self, world, rollout, *args):
+		if not hasattr(os, 'fork'):
+			raise OSError('World forks need os.fork (Linux, macOS)')
+
+		# buffered outputs would be written again by the child
+		sys.stdout.flush()
+		sys.stderr.flush()
+
+		read_fd, write_fd = os.pipe()
+		self.pid = os.fork()
+		if self.pid == 0:
+			os.close(read_fd)
+			run_child(world, rollout, args, write_fd)
+
+		os.close(write_fd)
+		self.file = os.fdopen(read_fd, 'rb')
+		self.done = False
+		self.status = None
+		self.payload = None
+
+	def wait(self):
+		if self.done:
+			return
+		data = self.file.read()
+		self.file.close()
+		os.waitpid(self.pid, 0)
+		self.done = True
+		if data:
+			self.status, self.payload = pickle.loads(data)
+		else:
+			self.status, self.payload = 'error', 'the fork exited without result'
+
+	def result(self):
+		# waits for the rollout, returns its result or raises its error
+		self.wait()
+		if self.status == 'error':
+			raise RuntimeError('Rollout failed:\n' + self.payload)
+		return self.payload
+
+
+def run_child(world, rollout, args, write_fd):
+	try:
+		world.step_hooks = []
+		# the profile of the parent is not overwritten by the fork
+		world.profiler = None
+		fw = HeadlessFramework('fork', world)
+		# the time of the fork goes on from the time of the world
+		fw.steps = world.n_steps
+		fw.time = world.n_steps * fw.TIMESTEP
+		data = pickle.dumps(('ok', rollout(world, fw, *args)))
+	except BaseException:
+		data = pickle.dumps(('error', traceback.format_exc()))
+
+	try:
+		with os.fdopen(write_fd, 'wb') as f:
+			f.write(data)
+		sys.stdout.flush()
+		sys.stderr.flush()
+	finally:
+		# no cleanup of the parent state (pygame, threads, atexit)
+		os._exit(0)
+
+
+def fork_rollouts(world, rollouts, *args, max_forks = None):
+	# runs the rollouts on forks of the world, at most max_forks at a time
+	# (default: the number of CPUs), returns their results in order
+	max_forks = max_forks or mp.cpu_count()
+	results = []
+	forks = []
+	try:
+		for rollout in rollouts:
+			if len(forks) == max_forks:
+				results.append(forks.pop(0).result())
+			forks.append(WorldFork(world, rollout, *args))
+		while forks:
+			results.append(forks.pop(0).result())
+	finally:
+		# no child is left behind if a rollout failed
+		for f in forks:
+			f.wait()
+	return results
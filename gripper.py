@@ -32,6 +32,7 @@ class Gripper:
 		self.claws = claws
 		if self.claws is None:
 			self.claws = Gripper.__default__claw
+		self.draw_vertices = [np.array(vertices) for vertices in self.claws]
 		
 		pos_t =  self.vehicle.b2body.transform * b2Vec2(position)
 		angle_t = self.vehicle.b2body.angle + angle
@@ -67,10 +68,8 @@ class Gripper:
 
 		
 	def draw(self, fw):
-		for i, vertices in enumerate(self.claws):
-			transform = self.b2bodies[i].transform
-			vertices = [transform * v for v in vertices]
-			fw.DrawPolygon( vertices, (255, 255, 255, 255))
+		for b2body, vertices in zip(self.b2bodies, self.draw_vertices):
+			fw.DrawBodyPolygon( b2body, vertices, (255, 255, 255, 255))
 
 			
 	def open(self):
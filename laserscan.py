@@ -7,6 +7,7 @@
 from Box2D import (b2Vec2, b2RayCastCallback, b2_pi)
 import math
 import numpy as np
+import time
 
 """
 Laser based on:
@@ -72,29 +73,306 @@ class Laser(b2RayCastCallback):
 			fw.DrawEdge( ray[0], ray[1], (128,128,255, 128) )
 
 
+class SensorBuffer():
+	# Readings of all the LaserScans of a world, in contiguous arrays: one
+	# row per ray, the rays of each scan are consecutive. values, hits and
+	# hit_points of each scan are views on its rows. The arrays double
+	# when full and the views of the scans are then re-pointed: keep the
+	# scan, not its views, from one step to the next.
+
+	def __init__(self, world, capacity = 64):
+		self.world = world
+		self.scans = []
+		self.size = 0
+		self.values = np.zeros(capacity, dtype=np.float32)
+		self.hits = np.zeros(capacity, dtype=bool)
+		self.hit_points = np.zeros((capacity, 2), dtype=np.float32)
+
+	def register(self, scan):
+		# rows of a new scan
+		rows = slice(self.size, self.size + scan.n_sensors)
+		self.size += scan.n_sensors
+		if self.size > len(self.values):
+			self.grow(max(2 * len(self.values), self.size))
+		self.scans.append(scan)
+		return rows
+
+	def grow(self, capacity):
+		for name in ('values', 'hits', 'hit_points'):
+			old = getattr(self, name)
+			new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+			new[:len(old)] = old
+			setattr(self, name, new)
+		for scan in self.scans:
+			scan.bind()
+
+	def fill(self, fw):
+		# updates the batched and visibility scans that are due, before the
+		# bodies step; their own step then keeps the readings. Each scan is
+		# still cast on its own: one query for all of them would cull the
+		# geometry by the box around all the emitters
+		for scan in self.scans:
+			if scan.batched or scan.visibility:
+				scan.update(fw)
+
+
 class LaserScan():
 
-	def __init__(self, vehicle, position = (0,5), range = (8,30), angle_range = (0, +b2_pi), n_sensors = 5 ):
+	# largest motion (m, rad) of the emitter and of the bodies around it
+	# under which the readings of the last cast are kept
+	still_epsilon = 1e-5
+
+	def __init__(self, vehicle, position = (0,5), range = (8,30), angle_range = (0, +b2_pi), n_sensors = 5, batched = False, update_period = None, skip_still = True, visibility = False ):
 		self.array = []
-		self.values = []
 		self.angles = np.linspace( angle_range[0], angle_range[1], n_sensors )
-		self.n_sensors = 5
+		self.n_sensors = n_sensors
+		self.vehicle = vehicle
+		self.position = position
+		self.range = range
+
+		# batched mode: the whole scan is cast at once against vehicle.world.geometry
+		self.batched = batched
+		self.directions = np.column_stack((np.cos(self.angles), np.sin(self.angles)))
+		# visibility mode: the rays are sampled from the visibility polygon
+		# of the emitter (raycast.VisibilityPolygon), kept in self.polygon
+		self.visibility = visibility
+		self.polygon = None
+
+		# values, hits and hit_points: views on the sensor buffer of the world
+		self.rows = vehicle.world.sensors.register(self)
+		self.bind()
+		self.values[:] = range[1]
 
 		for angle in self.angles:
 			laser = Laser(vehicle, position, range, angle)
 			self.array.append(laser)
-			self.values.append(range[1])
+
+		# the scan is cast every update_period seconds (None: at every step),
+		# the values are kept in between
+		self.n_updates = 0
+		self.updated_at = None
+		self.set_update_period(update_period)
+
+		# casts are skipped while nothing in range moved (see still)
+		self.skip_still = skip_still
+		self.n_skipped = 0
+		self.last_cast = None
+
+	def bind(self):
+		sensors = self.vehicle.world.sensors
+		self.values = sensors.values[self.rows]
+		self.hits = sensors.hits[self.rows]
+		self.hit_points = sensors.hit_points[self.rows]
+
+	def set_update_period(self, update_period):
+		self.update_period = update_period
+		self.phase = self.vehicle.world.next_sensor_phase(update_period)
 			
 	def step(self, fw):
-		for idx, laser in enumerate(self.array):
-			laser.hit = False
-			laser.step(fw)
-			self.values[idx] = laser.value
+		self.update(fw)
+
+	def update(self, fw):
+		world = self.vehicle.world
+		# at most one cast per step, the world may have cast it already
+		if self.updated_at == world.n_steps or not world.sensor_due(self.update_period, self.phase, fw):
+			return
+		self.updated_at = world.n_steps
+
+		profiler = world.profiler
+		if profiler is not None:
+			start = time.perf_counter()
+
+		if self.skip_still and self.still():
+			self.n_skipped += 1
+			if profiler is not None:
+				profiler.add('sensors', time.perf_counter() - start)
+			return
+		self.n_updates += 1
+
+		if self.visibility:
+			self.step_visibility(fw)
+		elif self.batched:
+			self.step_batched(fw)
+		else:
+			for idx, laser in enumerate(self.array):
+				laser.hit = False
+				laser.step(fw)
+				self.values[idx] = laser.value
+				self.hits[idx] = laser.hit
+				if laser.hit:
+					self.hit_points[idx] = tuple(laser.hit_point)
+
+		if profiler is not None:
+			profiler.add('sensors', time.perf_counter() - start)
+			profiler.count_rays(self.n_sensors)
+
+	def still(self):
+		# True if, since the last cast, the body of the emitter and the dynamic
+		# bodies that may be in range (now or then) moved by less than
+		# still_epsilon. Sleeping bodies keep their pose, so do awake ones
+		# that Box2D has not put to sleep yet.
+		b2body = self.vehicle.b2body
+		position = b2body.position
+		x, y, angle = position[0], position[1], b2body.angle
+		last = self.last_cast
+		epsilon = self.still_epsilon
+
+		# the emitter first, without NumPy: a moving robot casts at once
+		if last is not None and abs(x - last[0]) <= epsilon and abs(y - last[1]) <= epsilon and abs(angle - last[2]) <= epsilon:
+			geometry = self.vehicle.world.geometry
+			reach = self.range[1] + math.hypot(*self.position)
+			near = geometry.bodies_near((x - reach, y - reach), (x + reach, y + reach))
+			if last[3] == geometry.n_builds:
+				watched = near | last[5]
+				if not (np.abs(geometry.body_poses[watched] - last[4][watched]) > epsilon).any():
+					return True
+			self.last_cast = (x, y, angle, geometry.n_builds, geometry.body_poses, near)
+			return False
+
+		# the bodies around are read at the next still check only
+		self.last_cast = (x, y, angle, -1, None, None)
+		return False
+
+	def get_emitter(self):
+		# emitter position and ray directions, in world coordinates
+		b2body = self.vehicle.b2body
+		c, s = math.cos(b2body.angle), math.sin(b2body.angle)
+		rotation = np.array([[c, -s], [s, c]])
+		emitter_pos = rotation @ self.position + tuple(b2body.position)
+		return emitter_pos, self.directions @ rotation.T
+
+	def step_batched(self, fw):
+		emitter_pos, directions = self.get_emitter()
+		self.values[:], self.hits[:], self.hit_points[:] = self.vehicle.world.geometry.cast(emitter_pos, directions, self.range)
+
+	def step_visibility(self, fw):
+		emitter_pos, _ = self.get_emitter()
+		self.polygon = self.vehicle.world.geometry.visibility(emitter_pos, self.range)
+		self.values[:], self.hits[:], self.hit_points[:] = self.polygon.sample(self.angles + self.vehicle.b2body.angle)
 
 			
+	def get_state(self):
+		# readings and hits of the last cast, as arrays (see World.snapshot)
+		return (self.values.copy(), self.hits.copy(), self.hit_points.copy(), self.n_updates)
+
+	def set_state(self, state):
+		values, hits, hit_points, self.n_updates = state
+		self.values[:] = values
+		self.hits[:] = hits
+		self.hit_points[:] = hit_points
+		self.updated_at = None
+		self.last_cast = None
+		if self.batched or self.visibility:
+			return
+		for laser, value, hit, hit_point in zip(self.array, values.tolist(), hits.tolist(), hit_points.tolist()):
+			laser.value = value
+			laser.hit = hit
+			laser.hit_point = b2Vec2(hit_point) if hit else None
+
 	def draw(self, fw, show_emitter = True):
+		# the rays of the whole scan are computed at once, as in step_batched
+		emitter_pos, directions = self.get_emitter()
 		if(show_emitter):
-			emitter_pos = self.array[0].get_emitter_pos()
 			fw.DrawCircle( emitter_pos, 1.5, (0,0,255,255) )
-		for laser in self.array:
-			laser.draw(fw)
+
+		ray_p1 = (emitter_pos + self.range[0] * directions).tolist()
+		ray_p2 = (emitter_pos + self.range[1] * directions).tolist()
+
+		for p1, p2, hit, hit_point in zip(ray_p1, ray_p2, self.hits.tolist(), self.hit_points.tolist()):
+			if hit:
+				fw.DrawEdge( p1, hit_point, (128,128,255, 128) )
+				fw.DrawCircle( hit_point, 0.5, (255,0,0,255) )
+			else:
+				fw.DrawEdge( p1, p2, (128,128,255, 128) )
+
+
+class ScanHistory():
+	# Last `length` readings of a LaserScan, in a preallocated ring buffer.
+	# Appending is O(1) in the length of the history: running sums give the
+	# rolling means, quantiles partially sort the window of each ray.
+	# Sectors name groups of rays, e.g. {'right': slice(0, 15), ...}
+
+	def __init__(self, scan, length = 30, sectors = None):
+		self.scan = scan
+		self.length = length
+		self.sectors = sectors if sectors is not None else {}
+
+		n_rays = len(scan.values)
+		self.buffer = np.zeros((length, n_rays))
+		self.sum = np.zeros(n_rays)
+		self.count = 0
+		self.head = 0
+
+	def __len__(self):
+		return self.count
+
+	def full(self):
+		return self.count == self.length
+
+	def append(self, values = None):
+		if values is None:
+			values = self.scan.values
+
+		row = self.buffer[self.head]
+		if self.count == self.length:
+			self.sum -= row
+		else:
+			self.count += 1
+		row[:] = values
+		self.sum += row
+
+		self.head = (self.head + 1) % self.length
+		# once per turn, drop the rounding errors of the running sums
+		if self.head == 0:
+			self.sum[:] = self.buffer.sum(axis=0)
+
+	def rays(self, sector):
+		# name of a sector, slice or indices of rays, or None for all the rays
+		if sector is None:
+			return slice(None)
+		if isinstance(sector, str):
+			return self.sectors[sector]
+		return sector
+
+	def window(self, sector = None):
+		# readings of the history (unordered), one row per step
+		return self.buffer[:self.count, self.rays(sector)]
+
+	def get_state(self):
+		# contents of the ring buffer (see World.snapshot)
+		return (self.buffer.copy(), self.sum.copy(), self.count, self.head)
+
+	def set_state(self, state):
+		buffer, total, self.count, self.head = state
+		self.buffer[:] = buffer
+		self.sum[:] = total
+
+	def ordered(self):
+		# readings of the history, from the oldest to the newest
+		if self.count < self.length:
+			return self.buffer[:self.count].copy()
+		return np.roll(self.buffer, -self.head, axis=0)
+
+	def mean(self, sector = None):
+		# rolling mean of each ray
+		return self.sum[self.rays(sector)] / max(self.count, 1)
+
+	def sector_mean(self, sector = None):
+		# rolling mean over all the rays of a sector
+		return self.mean(sector).mean()
+
+	def quantile(self, q, sector = None):
+		# rolling quantile of each ray
+		return np.quantile(self.window(sector), q, axis=0)
+
+	def median(self, sector = None):
+		# rolling median of each ray
+		return np.median(self.window(sector), axis=0)
+
+	def sector_quantile(self, q, sector = None):
+		# rolling quantile over all the rays of a sector
+		return np.quantile(self.window(sector), q)
+
+	def sector_median(self, sector = None):
+		# rolling median over all the rays of a sector
+		return np.median(self.window(sector))
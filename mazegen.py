@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+import numpy as np
+import random
+
+"""
+Seeded maze generator for world.Maze: a perfect maze (one path between any
+two cells) carved in a grid of rows x columns cells by a depth-first search.
+
+The walls left standing are merged into maximal straight runs, and the runs
+meeting end to end into edge chains, so that a large maze has few fixtures
+and few edges:
+
+	boundaries, start_line, end_line = generate_maze(100, 100, seed=3)
+	maze = Maze(world, boundaries, scale_ratio=1, start_line=start_line, end_line=end_line)
+
+The start line is the first passage of the path from the first cell, (0, 0),
+to the last one, (rows-1, columns-1), the end line its last passage;
+cell_center gives where to put a vehicle. Coordinates are in the frame of
+the Maze body (at (0, 20) in the world), the maze centered on its origin.
+"""
+
+def carve(rows, columns, rng):
+	# depth-first search from cell (0, 0): the walls left, as
+	# horizontal[r, c] (below cell (r, c), r in [0, rows]) and
+	# vertical[r, c] (left of cell (r, c), c in [0, columns]), and the
+	# parent of each cell in the search
+	horizontal = np.ones((rows + 1, columns), dtype=bool)
+	vertical = np.ones((rows, columns + 1), dtype=bool)
+	parent = {(0, 0): None}
+	stack = [(0, 0)]
+
+	while stack:
+		r, c = stack[-1]
+		neighbours = [(r + dr, c + dc) for dr, dc in ((1, 0), (-1, 0), (0, 1), (0, -1))
+						if 0 <= r + dr < rows and 0 <= c + dc < columns and (r + dr, c + dc) not in parent]
+		if not neighbours:
+			stack.pop()
+			continue
+		nr, nc = rng.choice(neighbours)
+		if nr != r:
+			horizontal[max(r, nr), c] = False
+		else:
+			vertical[r, max(c, nc)] = False
+		parent[(nr, nc)] = (r, c)
+		stack.append((nr, nc))
+
+	return horizontal, vertical, parent
+
+
+def runs(walls):
+	# maximal runs of True along the rows of walls: (row, first, end)
+	padded = np.zeros((walls.shape[0], walls.shape[1] + 2), dtype=np.int8)
+	padded[:, 1:-1] = walls
+	steps = np.diff(padded, axis=1)
+	rows, starts = np.nonzero(steps == 1)
+	_, ends = np.nonzero(steps == -1)
+	return zip(rows.tolist(), starts.tolist(), ends.tolist())
+
+
+def join(segments):
+	# polylines of segments (pairs of grid points) meeting end to end, broken
+	# where more than two segments meet
+	touching = {}
+	for idx, (p, q) in enumerate(segments):
+		touching.setdefault(p, []).append(idx)
+		touching.setdefault(q, []).append(idx)
+	used = [False] * len(segments)
+
+	def walk(vertex, idx):
+		chain = [vertex]
+		while idx is not None:
+			used[idx] = True
+			p, q = segments[idx]
+			vertex = q if p == vertex else p
+			chain.append(vertex)
+			idx = None
+			if len(touching[vertex]) == 2:
+				idx = next((i for i in touching[vertex] if not used[i]), None)
+		return chain
+
+	chains = []
+	for vertex, idxs in touching.items():
+		if len(idxs) != 2:
+			for idx in idxs:
+				if not used[idx]:
+					chains.append(walk(vertex, idx))
+	# closed loops
+	for idx, (p, q) in enumerate(segments):
+		if not used[idx]:
+			chains.append(walk(p, idx))
+	return chains
+
+
+def generate_maze(rows, columns, cell_size = 20, seed = None):
+	# boundaries, start_line and end_line for world.Maze (with scale_ratio=1)
+	rng = random.Random(seed)
+	horizontal, vertical, parent = carve(rows, columns, rng)
+
+	# walls as segments between grid points (x, y): x = column, y = row
+	segments = [((first, y), (end, y)) for y, first, end in runs(horizontal)]
+	segments += [((x, first), (x, end)) for x, first, end in runs(vertical.T)]
+
+	x0, y0 = -columns * cell_size / 2, -rows * cell_size / 2
+	def point(grid_point):
+		return (x0 + grid_point[0] * cell_size, y0 + grid_point[1] * cell_size)
+
+	boundaries = [[point(p) for p in chain] for chain in join(segments)]
+
+	# the first and last passages of the path from the first cell to the last
+	path = [(rows - 1, columns - 1)]
+	while parent[path[-1]] is not None:
+		path.append(parent[path[-1]])
+	start_line, end_line = [], []
+	if len(path) > 1:
+		start_line = [point(p) for p in passage(path[-1], path[-2])]
+		end_line = [point(p) for p in passage(path[1], path[0])]
+
+	return boundaries, start_line, end_line
+
+
+def passage(a, b):
+	# grid points of the side shared by two neighbouring cells (row, column)
+	(ra, ca), (rb, cb) = a, b
+	if ra != rb:
+		y = max(ra, rb)
+		return [(ca, y), (ca + 1, y)]
+	x = max(ca, cb)
+	return [(x, ra), (x, ra + 1)]
+
+
+def cell_center(row, column, rows, columns, cell_size = 20):
+	# center of a cell of a maze of generate_maze, in the frame of the Maze
+	return (-columns * cell_size / 2 + (column + 0.5) * cell_size,
+			-rows * cell_size / 2 + (row + 0.5) * cell_size)
+
+
+if __name__ == "__main__":
+	import sys
+	import time
+	from world import World, Maze
+	from platforms import Rover
+	from IO import Framework
+
+	rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+	start = time.perf_counter()
+	boundaries, start_line, end_line = generate_maze(rows, rows, seed=0)
+	world = World()
+	maze = Maze(world, boundaries, scale_ratio=1, start_line=start_line, end_line=end_line)
+	world.bodies.append( maze )
+	print('%dx%d maze: %d chains, %d edge fixtures, built in %.3f s' % (rows, rows, len(boundaries),
+			len(maze.b2body.fixtures), time.perf_counter() - start))
+
+	x, y = cell_center(0, 0, rows, rows)
+	world.bodies.append( Rover(world, position=(x, y + 20)) )
+	screen = Framework("Maze", world)
+	screen.PPM = 400 / (rows * 20)
+	screen.run()
@@ -5,7 +5,7 @@
 @organization: CHArt - Université Paris 8
 """
 from IO import Keys
-from vehicle import Vehicle
+from vehicle import Vehicle, KinematicVehicle
 from laserscan import LaserScan
 from gripper import Gripper
 from Box2D import b2_pi
@@ -37,10 +37,10 @@ class KeyboardVehicle(Vehicle):
 class LaserScanVehicle(Vehicle):
 	laserscan = None
 	
-	def __init__( self, world, show_profile=False, **vehicle_kws,):
+	def __init__( self, world, show_profile=False, laser_period=None, **vehicle_kws,):
 		super().__init__( world, **vehicle_kws)
 		
-		self.laserscan = LaserScan(self, n_sensors = 45)
+		self.laserscan = LaserScan(self, n_sensors = 45, update_period = laser_period)
 		
 	def step(self, fw):
 		super().step(fw)
@@ -89,17 +89,19 @@ class GripperKeyboardVehicle( GripperVehicle, KeyboardVehicle):
 class irVehicle( Vehicle):
 	frontal_ir = None
 	rear_ir = None
-	def __init__( self, world, **vehicle_kws,):
+	def __init__( self, world, ir_period=None, **vehicle_kws,):
 		super().__init__( world, **vehicle_kws)
 		self.front_ir = LaserScan(self, position=(0,6),
 											range = (3,6),
 											angle_range = (1/4*b2_pi, 3/4*b2_pi),
-											n_sensors = 3)
+											n_sensors = 3,
+											update_period = ir_period)
 
 		self.rear_ir = LaserScan(self, position=(0,2.6),
 										range = (3,6),
 										angle_range = (5/4*b2_pi, 7/4*b2_pi),
-										n_sensors = 3)
+										n_sensors = 3,
+										update_period = ir_period)
 
 	def step(self, fw):
 		super().step(fw)
@@ -127,3 +129,9 @@ class KeyboardRover( LaserKeyboardVehicle, GripperKeyboardVehicle, irKeyboardVeh
 		super().__init__( world, **vehicle_kws)
 
 
+class KinematicRover( Rover, KinematicVehicle ):
+	# a Rover without tire dynamics, see vehicle.KinematicVehicle
+	def __init__( self, world, **vehicle_kws,):
+		super().__init__( world, **vehicle_kws)
+
+
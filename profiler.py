@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from collections import deque
+import numpy as np
+import json
+import time
+
+"""
+Opt-in profiler of the simulation loop:
+
+	world.profiler = Profiler('profile.json')
+
+World.step, Vehicle.step, LaserScan.step and Framework.run then time their
+phases with perf_counter, nothing is timed when world.profiler is None.
+
+Step phases: physics (Box2D Step), friction (tires of the vehicles), sensors
+(laser and ir casts), controller (the rest of the step of the bodies), hooks
+(step hooks, e.g. recorders). Frame phases: draw, flip, tick (waiting for
+the frame rate). The step of each body is timed too, and rays are counted.
+
+The framework shows a live breakdown with DrawText; summary() gives the mean
+and percentiles of each phase, dump() writes it as JSON.
+"""
+
+STEP_PHASES = ('physics', 'friction', 'sensors', 'controller', 'hooks')
+FRAME_PHASES = ('draw', 'flip', 'tick')
+
+
+class Profiler():
+
+	def __init__(self, path = None, max_samples = 100000, refresh = 0.5):
+		self.path = path
+		self.refresh = refresh
+
+		phases = STEP_PHASES + FRAME_PHASES
+		# one sample per step (or frame) and phase, the last max_samples are kept
+		self.samples = {phase: deque(maxlen=max_samples) for phase in phases}
+		self.totals = dict.fromkeys(phases, 0.0)
+		self.current = dict.fromkeys(phases, 0.0)
+		# id(body): [name, total, steps, max]
+		self.bodies = {}
+
+		self.n_steps = 0
+		self.n_frames = 0
+		self.ray_casts = 0
+		self.start = time.perf_counter()
+
+		# overlay, updated every refresh seconds from the recent totals
+		self.recent = dict.fromkeys(phases, 0.0)
+		self.recent_steps = 0
+		self.recent_frames = 0
+		self.recent_rays = 0
+		self.last_refresh = self.start
+		self.lines = []
+
+
+	def add(self, phase, elapsed):
+		self.current[phase] += elapsed
+
+	def add_body(self, body, elapsed):
+		stats = self.bodies.get(id(body))
+		if stats is None:
+			stats = self.bodies[id(body)] = ['%d %s' % (len(self.bodies), type(body).__name__), 0.0, 0, 0.0]
+		stats[1] += elapsed
+		stats[2] += 1
+		if elapsed > stats[3]:
+			stats[3] = elapsed
+
+	def count_rays(self, n):
+		self.ray_casts += n
+		self.recent_rays += n
+
+	def end_step(self, bodies_time):
+		# the controller is what remains of the step of the bodies
+		current = self.current
+		current['controller'] = max(0.0, bodies_time - current['friction'] - current['sensors'])
+		self.close(STEP_PHASES)
+		self.n_steps += 1
+		self.recent_steps += 1
+
+	def end_frame(self):
+		self.close(FRAME_PHASES)
+		self.n_frames += 1
+		self.recent_frames += 1
+
+	def close(self, phases):
+		current = self.current
+		for phase in phases:
+			self.samples[phase].append(current[phase])
+			self.totals[phase] += current[phase]
+			self.recent[phase] += current[phase]
+			current[phase] = 0.0
+
+
+	def draw(self, fw, color = (255, 255, 127)):
+		now = time.perf_counter()
+		if now - self.last_refresh >= self.refresh:
+			self.update_lines(now)
+		for line in self.lines:
+			fw.DrawText(line, color)
+
+	def update_lines(self, now):
+		steps = max(self.recent_steps, 1)
+		frames = max(self.recent_frames, 1)
+		self.lines = ['%-10s %6.2f ms/step' % (phase, self.recent[phase] / steps * 1e3) for phase in STEP_PHASES]
+		self.lines += ['%-10s %6.2f ms/frame' % (phase, self.recent[phase] / frames * 1e3) for phase in FRAME_PHASES]
+		self.lines.append('%-10s %6.1f /step, %.0f steps/s' % ('rays', self.recent_rays / steps,
+									self.recent_steps / (now - self.last_refresh)))
+
+		# slowest bodies, since the beginning
+		bodies = sorted(self.bodies.values(), key=lambda stats: -stats[1])[:3]
+		self.lines += ['%-10s %6.1f us/step' % (name, total / n * 1e6) for name, total, n, _ in bodies]
+
+		self.recent = dict.fromkeys(self.recent, 0.0)
+		self.recent_steps = self.recent_frames = self.recent_rays = 0
+		self.last_refresh = now
+
+
+	def summary(self):
+		phases = {}
+		for phase, samples in self.samples.items():
+			if not samples:
+				continue
+			x = np.fromiter(samples, dtype=float) * 1e3
+			p50, p90, p99 = np.percentile(x, (50, 90, 99))
+			phases[phase] = {'per': 'step' if phase in STEP_PHASES else 'frame',
+								'total_s': self.totals[phase],
+								'mean_ms': float(x.mean()),
+								'p50_ms': float(p50),
+								'p90_ms': float(p90),
+								'p99_ms': float(p99),
+								'max_ms': float(x.max())}
+
+		bodies = {name: {'mean_us': total / n * 1e6, 'max_us': max_time * 1e6, 'steps': n}
+					for name, total, n, max_time in self.bodies.values()}
+
+		elapsed = time.perf_counter() - self.start
+		return {'steps': self.n_steps,
+				'frames': self.n_frames,
+				'elapsed_s': elapsed,
+				'steps_per_s': self.n_steps / elapsed if elapsed > 0 else 0.0,
+				'ray_casts': self.ray_casts,
+				'ray_casts_per_step': self.ray_casts / max(self.n_steps, 1),
+				'phases': phases,
+				'bodies': bodies}
+
+	def dump(self, path = None):
+		path = path or self.path
+		with open(path, 'w') as f:
+			json.dump(self.summary(), f, indent=1)
+		return path
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from IO import HeadlessFramework
+from Box2D import b2ContactListener
+import multiprocessing as mp
+import importlib
+import argparse
+import math
+import random
+import numpy as np
+
+"""
+Headless races of a Rover in a Maze, from its start line to its end line.
+
+Race(world, rover, maze) is a step hook: at each step it tests the segment
+between the previous and the current position of the chassis against the
+start and end lines of the maze, sums the distance travelled and counts the
+collisions of the rover (each time it goes from no contact to a contact
+between its bodies and any other body). The lap time, in simulated seconds,
+runs from the first crossing of the start line to the next crossing of the
+end line.
+
+run_races fans (variant, seed) races out over a process pool; make_race(seed)
+is a picklable function returning (world, rover, maze). rank orders the
+variants by completion, then by mean lap time.
+
+	python race.py ex_5.MyRover ex_8.MyRover --seeds 8 --maze generated
+"""
+
+def crosses(p1, p2, a, b):
+	# True if the segment p1-p2 crosses the segment a-b
+	def side(o, u, v):
+		return (u[0] - o[0]) * (v[1] - o[1]) - (u[1] - o[1]) * (v[0] - o[0])
+	d1, d2 = side(a, b, p1), side(a, b, p2)
+	d3, d4 = side(p1, p2, a), side(p1, p2, b)
+	return d1 * d2 <= 0 and d3 * d4 <= 0 and (d1 != d2)
+
+
+def vehicle_b2bodies(rover):
+	# the chassis and every body jointed to it (tires, gripper)
+	bodies = [rover.b2body]
+	for body in bodies:
+		for edge in body.joints:
+			if edge.other not in bodies:
+				bodies.append(edge.other)
+	return bodies
+
+
+class CollisionCounter(b2ContactListener):
+	# counts the collisions of the given bodies with the others: a bump into
+	# a wall touches several edges, with the chassis, the tires or the claws,
+	# it is counted once, when the first of these contacts begins
+
+	def __init__(self, b2bodies):
+		b2ContactListener.__init__(self)
+		self.b2bodies = set(b2bodies)
+		self.count = 0
+		# contacts going on between the bodies and the others
+		self.touching = 0
+
+	def between(self, contact):
+		a, b = contact.fixtureA, contact.fixtureB
+		if a.sensor or b.sensor:
+			return False
+		return (a.body in self.b2bodies) != (b.body in self.b2bodies)
+
+	def BeginContact(self, contact):
+		if self.between(contact):
+			if self.touching == 0:
+				self.count += 1
+			self.touching += 1
+
+	def EndContact(self, contact):
+		if self.between(contact):
+			# contacts begun before the counter was set are not counted
+			self.touching = max(self.touching - 1, 0)
+
+
+class Race():
+
+	def __init__(self, world, rover, maze, stop = True):
+		self.world = world
+		self.rover = rover
+		# lines in world coordinates
+		transform = maze.b2body.transform
+		self.start_line = [tuple(transform * p) for p in maze.start_line]
+		self.end_line = [tuple(transform * p) for p in maze.end_line]
+		# stop: fw.run returns once the end line is crossed
+		self.stop = stop
+
+		self.position = tuple(rover.b2body.position)
+		self.distance = 0.0
+		self.start_time = None
+		self.end_time = None
+
+		self.collisions = CollisionCounter(vehicle_b2bodies(rover))
+		world.b2world.contactListener = self.collisions
+		world.step_hooks.append(self)
+
+	def __call__(self, world, fw):
+		position = tuple(self.rover.b2body.position)
+		previous, self.position = self.position, position
+		self.distance += math.hypot(position[0] - previous[0], position[1] - previous[1])
+
+		if self.end_time is not None:
+			return
+		t = world.n_steps * fw.TIMESTEP
+		if self.start_time is None:
+			if self.start_line and crosses(previous, position, *self.start_line):
+				self.start_time = t
+		elif self.end_line and crosses(previous, position, *self.end_line):
+			self.end_time = t
+			if self.stop:
+				fw.running = False
+
+	@property
+	def finished(self):
+		return self.end_time is not None
+
+	@property
+	def lap_time(self):
+		return self.end_time - self.start_time if self.finished else None
+
+	def result(self):
+		return {'finished': self.finished,
+				'lap_time': self.lap_time,
+				'start_time': self.start_time,
+				'end_time': self.end_time,
+				'distance': self.distance,
+				'collisions': self.collisions.count,
+				'sim_time': self.world.n_steps * HeadlessFramework.TIMESTEP}
+
+
+def run_race(make_race, seed, max_time = 120.0):
+	# one race, in simulated seconds at most
+	random.seed(seed)
+	np.random.seed(seed)
+	world, rover, maze = make_race(seed)
+	race = Race(world, rover, maze)
+	HeadlessFramework('race %d' % seed, world).run(duration=max_time, verbose=False)
+	result = race.result()
+	result['seed'] = seed
+	return result
+
+
+def _run(job):
+	name, make_race, seed, max_time = job
+	result = run_race(make_race, seed, max_time)
+	result['variant'] = name
+	return result
+
+
+def run_races(variants, seeds, max_time = 120.0, processes = None):
+	# variants: name: make_race; returns name: [result of each seed]
+	jobs = [(name, make_race, seed, max_time) for name, make_race in variants.items() for seed in seeds]
+	results = {name: [] for name in variants}
+	with mp.Pool(processes) as pool:
+		for result in pool.imap(_run, jobs):
+			results[result['variant']].append(result)
+	return results
+
+
+def rank(results):
+	# (name, finished ratio, mean lap time, mean collisions), best first
+	table = []
+	for name, runs in results.items():
+		laps = [r['lap_time'] for r in runs if r['finished']]
+		table.append((name, len(laps) / len(runs),
+						sum(laps) / len(laps) if laps else float('inf'),
+						sum(r['collisions'] for r in runs) / len(runs)))
+	return sorted(table, key=lambda row: (-row[1], row[2]))
+
+
+
+# Example races: a rover class, given as module.Class
+def rover_class(path):
+	module, name = path.rsplit('.', 1)
+	return getattr(importlib.import_module(module), name)
+
+
+def default_maze_race(rover_path, seed):
+	# the maze of main_maze, the start heading jittered by the seed
+	from world import World, Maze
+
+	world = World()
+	maze = Maze(world)
+	world.bodies.append( maze )
+	angle = random.Random(seed).uniform(-0.2, 0.2)
+	rover = rover_class(rover_path)( world, position=(+90,-50), angle=angle)
+	world.bodies.append( rover )
+	return world, rover, maze
+
+
+def generated_maze_race(rover_path, seed, size = 4):
+	# a size x size maze generated from the seed, from its first cell
+	from world import World, Maze
+	from mazegen import generate_maze, cell_center
+
+	boundaries, start_line, end_line = generate_maze(size, size, seed=seed)
+	world = World()
+	maze = Maze(world, boundaries, scale_ratio=1, start_line=start_line, end_line=end_line)
+	world.bodies.append( maze )
+	x, y = cell_center(0, 0, size, size)
+	# facing the first passage (the rovers move along their y axis)
+	(x0, y0), (x1, y1) = start_line
+	angle = math.atan2(x - (x0 + x1) / 2, (y0 + y1) / 2 - y)
+	rover = rover_class(rover_path)( world, position=(x, y + 20), angle=angle)
+	world.bodies.append( rover )
+	return world, rover, maze
+
+
+if __name__ == "__main__":
+	from functools import partial
+
+	parser = argparse.ArgumentParser(description='Rank rover controllers by their lap time in a maze')
+	parser.add_argument('rovers', nargs='+', help='rover classes, as module.Class')
+	parser.add_argument('--seeds', type=int, default=4, help='races per rover')
+	parser.add_argument('--maze', choices=('default', 'generated'), default='default')
+	parser.add_argument('--max-time', type=float, default=120.0, help='simulated seconds per race')
+	parser.add_argument('--processes', type=int, default=None)
+	args = parser.parse_args()
+
+	make_race = default_maze_race if args.maze == 'default' else generated_maze_race
+	variants = {path: partial(make_race, path) for path in args.rovers}
+	results = run_races(variants, range(args.seeds), args.max_time, args.processes)
+
+	print('%-24s %9s %10s %11s' % ('rover', 'finished', 'lap time', 'collisions'))
+	for name, finished, lap_time, collisions in rank(results):
+		print('%-24s %8.0f%% %9.1fs %11.1f' % (name, finished * 100, lap_time, collisions))
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from Box2D import (b2_staticBody, b2EdgeShape, b2ChainShape, b2PolygonShape, b2CircleShape)
+import numpy as np
+
+"""
+Flat NumPy copy of the world's fixtures, used to cast a whole scan of rays
+in one pass instead of one b2World.RayCast (and one Python callback per
+fixture crossed) per ray.
+
+Follows the b2World.RayCast conventions: edges are two-sided, polygons and
+circles only report rays entering them from outside, the closest hit wins.
+
+Static segments are bucketed once in a uniform grid, so that a scan only
+visits the segments of the cells it covers, however large the maze.
+"""
+
+class WorldGeometry():
+
+	def __init__(self, world):
+		self.world = world
+		self.n_bodies = None
+		self.n_static_fixtures = None
+		self.n_builds = 0
+		self.refreshed_at = None
+		self.posed_at = None
+
+		# static geometry, in world coordinates, indexed by a grid
+		self.static_segments = Segments.empty()
+		self.static_circles = Circles.empty()
+		self.static_grid = SegmentGrid(self.static_segments)
+		self.static_crossings = np.zeros((0, 2))
+		self.static_crossing_pairs = (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+
+		# dynamic geometry, in body coordinates (+ index of the body)
+		self.dynamic_bodies = []
+		self.local_segments = Segments.empty()
+		self.local_circles = Circles.empty()
+		self.segment_body = np.zeros(0, dtype=int)
+		self.circle_body = np.zeros(0, dtype=int)
+		# distance from the origin of each body to its farthest point
+		self.body_radius = np.zeros(0)
+
+		# poses (x, y, angle) of the dynamic bodies and their geometry in
+		# world coordinates, updated once per step
+		self.body_poses = np.zeros((0, 3))
+		self.dynamic_segments = Segments.empty()
+		self.dynamic_circles = Circles.empty()
+
+
+	def invalidate(self):
+		# to be called when fixtures are added or removed without changing
+		# the number of bodies, or when bodies are moved outside of World.step
+		self.n_bodies = None
+		self.refreshed_at = None
+		self.posed_at = None
+
+
+	def build(self):
+		static_fixtures = []
+		local_segments, local_circles = [], []
+		segment_body, circle_body = [], []
+		self.dynamic_bodies = []
+
+		for body in self.world.b2world.bodies:
+			if body.type == b2_staticBody:
+				static_fixtures += body.fixtures
+				continue
+
+			body_idx = len(self.dynamic_bodies)
+			self.dynamic_bodies.append(body)
+			for fixture in body.fixtures:
+				segments, circles = shape_geometry(fixture.shape)
+				local_segments += segments
+				local_circles += circles
+				segment_body += [body_idx] * len(segments)
+				circle_body += [body_idx] * len(circles)
+
+		# static bodies never move: only rebuilt when static fixtures are added
+		if self.n_static_fixtures != len(static_fixtures):
+			self.build_static(static_fixtures)
+
+		self.local_segments = Segments(local_segments)
+		self.local_circles = Circles(local_circles)
+		self.segment_body = np.array(segment_body, dtype=int)
+		self.circle_body = np.array(circle_body, dtype=int)
+
+		self.body_radius = np.zeros(len(self.dynamic_bodies))
+		segments, circles = self.local_segments, self.local_circles
+		for points, body_idx, margin in ((segments.p, self.segment_body, 0.0),
+										 (segments.q, self.segment_body, 0.0),
+										 (circles.center, self.circle_body, circles.radius)):
+			np.maximum.at(self.body_radius, body_idx, np.hypot(points[:, 0], points[:, 1]) + margin)
+
+		self.n_bodies = self.world.b2world.bodyCount
+		self.n_builds += 1
+		self.refreshed_at = None
+		self.posed_at = None
+
+
+	def build_static(self, fixtures):
+		segments, circles = [], []
+		for fixture in fixtures:
+			transform = fixture.body.transform
+			fixture_segments, fixture_circles = shape_geometry(fixture.shape)
+			segments += [(transform * p, transform * q, one_sided) for p, q, one_sided in fixture_segments]
+			circles += [(transform * c, r) for c, r in fixture_circles]
+
+		self.static_segments = Segments(segments)
+		self.static_circles = Circles(circles)
+		self.static_grid = SegmentGrid(self.static_segments)
+		self.n_static_fixtures = len(fixtures)
+
+		# static segments crossing each other, for the visibility polygons
+		static = self.static_segments
+		i, j = self.static_grid.pairs()
+		self.static_crossings, cross = crossings(static.p[i], static.q[i], static.p[j], static.q[j])
+		self.static_crossing_pairs = (i[cross], j[cross])
+
+
+	def poses(self):
+		# poses of the dynamic bodies, read from Box2D once per step
+		if self.n_bodies != self.world.b2world.bodyCount:
+			self.build()
+
+		if self.posed_at != self.world.n_steps:
+			self.posed_at = self.world.n_steps
+			self.body_poses = np.array([(b.position[0], b.position[1], b.angle) for b in self.dynamic_bodies]).reshape(-1, 3)
+		return self.body_poses
+
+
+	def bodies_near(self, lower, upper):
+		# mask of the dynamic bodies whose bounding circle may overlap the box
+		poses = self.poses()
+		x, y, radius = poses[:, 0], poses[:, 1], self.body_radius
+		return (x + radius >= lower[0]) & (x - radius <= upper[0]) & (y + radius >= lower[1]) & (y - radius <= upper[1])
+
+
+	def refresh(self):
+		poses = self.poses()
+
+		if self.refreshed_at == self.world.n_steps:
+			return
+		self.refreshed_at = self.world.n_steps
+
+		self.dynamic_segments = self.local_segments.transformed(poses[self.segment_body])
+		self.dynamic_circles = self.local_circles.transformed(poses[self.circle_body])
+
+
+	def cast(self, origins, directions, range):
+		# origins: (2,) or (n, 2), directions: (n, 2) unit vectors
+		# range: (min, max) distance from the origin covered by the rays
+		# returns the distances from the origins, the hit flags and the hit points
+		self.refresh()
+
+		directions = np.asarray(directions, dtype=float).reshape(-1, 2)
+		origins = np.broadcast_to(np.asarray(origins, dtype=float), directions.shape)
+
+		ray_p1 = origins + range[0] * directions
+		ray_p2 = origins + range[1] * directions
+		lower = np.minimum(ray_p1, ray_p2).min(axis=0)
+		upper = np.maximum(ray_p1, ray_p2).max(axis=0)
+
+		static_segments = self.static_segments.take(self.static_grid.query_box(lower, upper))
+
+		distances = np.full(len(directions), np.inf)
+		for segments in (static_segments, self.dynamic_segments.cull(lower, upper)):
+			segments.intersect(origins, directions, range, distances)
+		for circles in (self.static_circles, self.dynamic_circles):
+			circles.cull(lower, upper).intersect(origins, directions, range, distances)
+
+		hits = np.isfinite(distances)
+		distances[~hits] = range[1]
+		hit_points = origins + distances[:, None] * directions
+
+		return distances, hits, hit_points
+
+
+	def visibility(self, origin, range):
+		# visibility polygon of the segments around origin, up to range[1];
+		# the circles are kept aside and intersected with each sampled ray
+		self.refresh()
+
+		origin = np.asarray(origin, dtype=float)
+		lower, upper = origin - range[1], origin + range[1]
+		near = self.static_grid.query_box(lower, upper)
+		segments = self.static_segments.take(near)
+		dynamic = self.dynamic_segments.cull(lower, upper)
+		circles = Circles(center = np.concatenate((self.static_circles.center, self.dynamic_circles.center)),
+						  radius = np.concatenate((self.static_circles.radius, self.dynamic_circles.radius)))
+
+		# crossings between static segments are known (even out of range,
+		# they change the closest segment), the dynamic segments are crossed
+		# with all the segments around
+		is_near = np.zeros(len(self.static_segments), dtype=bool)
+		is_near[near] = True
+		i, j = self.static_crossing_pairs
+		points = self.static_crossings[is_near[i] & is_near[j]]
+		segments = Segments(p = np.concatenate((segments.p, dynamic.p)),
+							q = np.concatenate((segments.q, dynamic.q)),
+							one_sided = np.concatenate((segments.one_sided, dynamic.one_sided)))
+		if len(dynamic):
+			dynamic_points, _ = crossings(dynamic.p[:, None], dynamic.q[:, None], segments.p[None], segments.q[None])
+			points = np.concatenate((points, dynamic_points))
+		return VisibilityPolygon(origin, range, segments, circles.cull(lower, upper), points)
+
+
+class VisibilityPolygon():
+	# Visibility from a point, after https://ncase.me/sight-and-light/: the
+	# closest segment can only change at the angle of a segment end (or of a
+	# crossing of two segments). One ray per interval between these angles,
+	# sorted, finds the visible segment of the interval; a ray at any angle
+	# is then intersected with the visible segments of its interval only.
+
+	def __init__(self, origin, range, segments, circles, crossings):
+		self.origin = origin
+		self.range = range
+		self.segments = segments
+		self.circles = circles
+
+		offsets = np.concatenate((segments.p, segments.q, crossings)) - origin
+		angles = np.arctan2(offsets[:, 1], offsets[:, 0])
+		angles = np.unique(np.concatenate((angles, (-np.pi, np.pi))))
+		# interval k: [angles[k], angles[k+1]]
+		self.angles = angles[np.concatenate(([True], np.diff(angles) > 1e-12))]
+		self.angles[-1] = np.pi
+
+		# visible segment of each interval (-1: none), regardless of the
+		# minimum range, checked when sampling
+		middle = (self.angles[:-1] + self.angles[1:]) / 2
+		directions = np.column_stack((np.cos(middle), np.sin(middle)))
+		self.visible = np.full(len(middle), -1)
+		if len(segments):
+			t = segments.fractions(np.broadcast_to(origin, directions.shape), directions, (0.0, np.inf))
+			closest = np.argmin(t, axis=1)
+			hit = np.isfinite(t[np.arange(len(middle)), closest])
+			self.visible[hit] = closest[hit]
+
+	def __len__(self):
+		return len(self.visible)
+
+	def vertices(self):
+		# corners of the polygon of the segments, two per interval (at its
+		# ends), clipped to the maximum range, in angle order
+		ends = np.column_stack((self.angles[:-1], self.angles[1:])).ravel()
+		directions = np.column_stack((np.cos(ends), np.sin(ends)))
+		visible = np.repeat(self.visible, 2)
+		idx = np.flatnonzero(visible >= 0)
+
+		distances = np.full(len(ends), float(self.range[1]))
+		t = line_fractions(self.segments.p[visible[idx]], self.segments.q[visible[idx]], self.origin, directions[idx])
+		distances[idx] = np.minimum(t, self.range[1])
+		return self.origin + distances[:, None] * directions
+
+	def sample(self, angles):
+		# distances, hit flags and hit points of rays cast from origin at
+		# the given angles (radians, world frame), as WorldGeometry.cast
+		angles = np.asarray(angles, dtype=float)
+		directions = np.column_stack((np.cos(angles), np.sin(angles)))
+		origins = np.broadcast_to(self.origin, directions.shape)
+		low, high = self.range
+
+		# a ray on an interval boundary may be stopped by either side
+		wrapped = np.mod(angles + np.pi, 2 * np.pi) - np.pi
+		right = np.clip(np.searchsorted(self.angles, wrapped, side='right') - 1, 0, len(self) - 1)
+		left = np.clip(np.searchsorted(self.angles, wrapped, side='left') - 1, 0, len(self) - 1)
+
+		distances = np.full(len(angles), np.inf)
+		for interval in (left, right):
+			visible = self.visible[interval]
+			idx = np.flatnonzero(visible >= 0)
+			segment = visible[idx]
+			t = line_fractions(self.segments.p[segment], self.segments.q[segment], self.origin, directions[idx])
+			distances[idx] = np.minimum(distances[idx], t)
+
+		# rays whose visible segment is within the minimum range see past it
+		near = np.flatnonzero(distances < low)
+		if len(near):
+			recast = np.full(len(near), np.inf)
+			self.segments.intersect(origins[near], directions[near], self.range, recast)
+			distances[near] = recast
+		distances[distances > high] = np.inf
+
+		self.circles.intersect(origins, directions, self.range, distances)
+		hits = np.isfinite(distances)
+		distances[~hits] = high
+		hit_points = origins + distances[:, None] * directions
+		return distances, hits, hit_points
+
+
+def line_fractions(p, q, origin, directions):
+	# distance along each ray to the line of its segment, inf if parallel
+	e = q - p
+	w = p - origin
+	denom = directions[:, 0] * e[:, 1] - directions[:, 1] * e[:, 0]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		t = (w[:, 0] * e[:, 1] - w[:, 1] * e[:, 0]) / denom
+	return np.where((denom != 0) & (t >= 0), t, np.inf)
+
+
+def crossings(p, q, r, s):
+	# points where each segment p-q crosses the segment r-s (broadcast),
+	# away from their ends, and the mask of the pairs that cross
+	e, f = q - p, s - r
+	w = r - p
+	denom = e[..., 0] * f[..., 1] - e[..., 1] * f[..., 0]
+	with np.errstate(divide='ignore', invalid='ignore'):
+		u = (w[..., 0] * f[..., 1] - w[..., 1] * f[..., 0]) / denom
+		v = (w[..., 0] * e[..., 1] - w[..., 1] * e[..., 0]) / denom
+		cross = (denom != 0) & (u > 0) & (u < 1) & (v > 0) & (v < 1)
+		return (p + u[..., None] * e)[cross], cross
+
+
+def shape_geometry(shape):
+	# segments (p, q, one_sided) and circles (center, radius) of a b2 shape
+	if isinstance(shape, b2EdgeShape):
+		p, q = shape.vertices
+		return [(p, q, False)], []
+
+	if isinstance(shape, b2ChainShape):
+		vertices = shape.vertices
+		return [(vertices[i], vertices[i+1], False) for i in range(len(vertices) - 1)], []
+
+	if isinstance(shape, b2PolygonShape):
+		# counter-clockwise vertices, outward normals on the right of each edge
+		vertices = shape.vertices
+		n = len(vertices)
+		return [(vertices[i], vertices[(i+1) % n], True) for i in range(n)], []
+
+	if isinstance(shape, b2CircleShape):
+		return [], [(shape.pos, shape.radius)]
+
+	return [], []
+
+
+def rotate(points, poses):
+	c, s = np.cos(poses[:, 2]), np.sin(poses[:, 2])
+	return np.column_stack((c * points[:, 0] - s * points[:, 1] + poses[:, 0],
+							s * points[:, 0] + c * points[:, 1] + poses[:, 1]))
+
+
+class Segments():
+
+	def __init__(self, segments = None, p = None, q = None, one_sided = None):
+		if segments is not None:
+			p = np.array([tuple(s[0]) for s in segments], dtype=float).reshape(-1, 2)
+			q = np.array([tuple(s[1]) for s in segments], dtype=float).reshape(-1, 2)
+			one_sided = np.array([s[2] for s in segments], dtype=bool)
+
+		self.p = p
+		self.q = q
+		self.one_sided = one_sided
+		self.lower = np.minimum(p, q)
+		self.upper = np.maximum(p, q)
+
+	@staticmethod
+	def empty():
+		return Segments([])
+
+	def __len__(self):
+		return len(self.p)
+
+	def transformed(self, poses):
+		return Segments(p = rotate(self.p, poses), q = rotate(self.q, poses), one_sided = self.one_sided)
+
+	def take(self, idx):
+		return Segments(p = self.p[idx], q = self.q[idx], one_sided = self.one_sided[idx])
+
+	def cull(self, lower, upper):
+		return self.take(np.all(self.upper >= lower, axis=1) & np.all(self.lower <= upper, axis=1))
+
+	def intersect(self, origins, directions, range, distances):
+		if len(self):
+			np.minimum(distances, self.fractions(origins, directions, range).min(axis=1), out=distances)
+
+	def fractions(self, origins, directions, range):
+		# origin + t * direction == p + u * (q - p), t within range, u within [0, 1]
+		# returns t for each ray and segment, inf if they do not cross
+		e = self.q - self.p
+		d = directions[:, None, :]
+		w = self.p[None, :, :] - origins[:, None, :]
+
+		denom = d[..., 0] * e[:, 1] - d[..., 1] * e[:, 0]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			t = (w[..., 0] * e[:, 1] - w[..., 1] * e[:, 0]) / denom
+			u = (w[..., 0] * d[..., 1] - w[..., 1] * d[..., 0]) / denom
+
+		# polygon edges only stop the rays coming from outside
+		valid = (denom != 0) & (~self.one_sided | (denom < 0))
+		valid &= (u >= 0) & (u <= 1) & (t >= range[0]) & (t <= range[1])
+
+		return np.where(valid, t, np.inf)
+
+
+class Circles():
+
+	def __init__(self, circles = None, center = None, radius = None):
+		if circles is not None:
+			center = np.array([tuple(c[0]) for c in circles], dtype=float).reshape(-1, 2)
+			radius = np.array([c[1] for c in circles], dtype=float)
+
+		self.center = center
+		self.radius = radius
+		self.lower = center - radius[:, None]
+		self.upper = center + radius[:, None]
+
+	@staticmethod
+	def empty():
+		return Circles([])
+
+	def __len__(self):
+		return len(self.center)
+
+	def transformed(self, poses):
+		return Circles(center = rotate(self.center, poses), radius = self.radius)
+
+	def cull(self, lower, upper):
+		mask = np.all(self.upper >= lower, axis=1) & np.all(self.lower <= upper, axis=1)
+		return Circles(center = self.center[mask], radius = self.radius[mask])
+
+	def intersect(self, origins, directions, range, distances):
+		if len(self):
+			np.minimum(distances, self.fractions(origins, directions, range).min(axis=1), out=distances)
+
+	def fractions(self, origins, directions, range):
+		# first crossing of the circle, rays starting inside do not hit
+		# directions need not be unit vectors, t is in units of their length
+		ray_p1 = origins + range[0] * directions
+		s = ray_p1[:, None, :] - self.center[None, :, :]
+		b = np.sum(s * s, axis=2) - self.radius ** 2
+		c = np.sum(s * directions[:, None, :], axis=2)
+		rr = np.sum(directions * directions, axis=1)[:, None]
+		sigma = c * c - rr * b
+
+		with np.errstate(invalid='ignore'):
+			a = -(c + np.sqrt(sigma)) / rr
+		valid = (sigma >= 0) & (a >= 0) & (a <= range[1] - range[0])
+
+		return np.where(valid, range[0] + a, np.inf)
+
+
+class SegmentGrid():
+	# Uniform grid bucketing segments by the cells their bounding box overlaps,
+	# stored as a sorted array of segment indices with per-cell offsets
+
+	def __init__(self, segments, cell_size = None):
+		self.segments = segments
+		n = len(segments)
+
+		if n == 0:
+			self.origin = np.zeros(2)
+			self.cell_size = 1.0
+			self.shape = np.ones(2, dtype=int)
+			self.cell_start = np.zeros(2, dtype=int)
+			self.cell_segments = np.zeros(0, dtype=int)
+			return
+
+		self.origin = segments.lower.min(axis=0)
+		extent = segments.upper.max(axis=0) - self.origin
+
+		if cell_size is None:
+			# about one segment per cell on average
+			cell_size = np.sqrt(np.prod(np.maximum(extent, 1.0)) / n)
+		self.cell_size = cell_size
+		self.shape = np.floor(extent / cell_size).astype(int) + 1
+
+		lower = self.cell_of(segments.lower)
+		size = self.cell_of(segments.upper) - lower + 1
+		counts = size[:, 0] * size[:, 1]
+
+		# enumerate the cells covered by each segment bounding box
+		segment_idx = np.repeat(np.arange(n), counts)
+		k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		width = size[segment_idx, 0]
+		cells = self.cell_id(lower[segment_idx, 0] + k % width, lower[segment_idx, 1] + k // width)
+
+		order = np.argsort(cells, kind='stable')
+		self.cell_segments = segment_idx[order]
+		self.cell_start = np.searchsorted(cells[order], np.arange(np.prod(self.shape) + 1))
+
+	def cell_of(self, points):
+		return np.floor((points - self.origin) / self.cell_size).astype(int)
+
+	def cell_id(self, ix, iy):
+		return iy * self.shape[0] + ix
+
+	def cells_in_box(self, lower, upper):
+		lower = np.maximum(self.cell_of(lower), 0)
+		upper = np.minimum(self.cell_of(upper), self.shape - 1)
+		if np.any(upper < lower):
+			return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+		ix, iy = np.meshgrid(np.arange(lower[0], upper[0] + 1), np.arange(lower[1], upper[1] + 1))
+		return ix.ravel(), iy.ravel()
+
+	def segments_in(self, cells):
+		start, end = self.cell_start[cells], self.cell_start[cells + 1]
+		counts = end - start
+		idx = np.repeat(start - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+		return np.unique(self.cell_segments[idx])
+
+	def pairs(self):
+		# pairs (i < j) of segments sharing at least one cell
+		counts = np.diff(self.cell_start)
+		position = np.arange(len(self.cell_segments))
+		n_after = np.repeat(self.cell_start[1:], counts) - position - 1
+		first = np.repeat(position, n_after)
+		second = first + 1 + np.arange(n_after.sum()) - np.repeat(np.cumsum(n_after) - n_after, n_after)
+
+		i, j = self.cell_segments[first], self.cell_segments[second]
+		n = len(self.segments)
+		pairs = np.unique(np.minimum(i, j) * n + np.maximum(i, j))
+		return np.divmod(pairs, n)
+
+	def query_box(self, lower, upper):
+		# indices of the segments that may overlap the box
+		ix, iy = self.cells_in_box(lower, upper)
+		return self.segments_in(self.cell_id(ix, iy))
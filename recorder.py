@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from Box2D import b2_staticBody
+from laserscan import LaserScan
+import numpy as np
+import threading
+import queue
+import json
+import time
+import os
+
+"""
+Trajectory recorder, hooked to World.step.
+
+Every step is a fixed-layout float32 record: step, time, the pose and
+velocities of every dynamic body (after the step), the forward speed of every
+tire and every laser reading (as read during the step). Records are gathered
+in chunks of chunk_steps rows; full chunks are written by a background thread
+as append-only .npy files (memory-mappable, with the NumPy header), next to a
+layout.json file naming the columns and listing the chunks written so far.
+
+The sim loop only copies values in the current chunk; it waits for the
+writer only if n_buffers chunks are already waiting to be written.
+"""
+
+class TrajectoryRecorder():
+
+	def __init__(self, world, path, chunk_steps = 3600, n_buffers = 4):
+		self.world = world
+		self.path = path
+		self.chunk_steps = chunk_steps
+		os.makedirs(path, exist_ok=True)
+
+		self.build_layout()
+
+		# preallocated chunks, cycling between the sim loop and the writer
+		self.free = queue.Queue()
+		for i in range(n_buffers):
+			self.free.put(np.zeros((chunk_steps, len(self.columns)), dtype=np.float32))
+		self.full = queue.Queue()
+		self.chunk = self.free.get()
+		self.n_rows = 0
+		self.n_chunks = 0
+		self.n_records = 0
+		self.n_written_chunks = 0
+		self.n_written_records = 0
+
+		# write cost, measured in the sim loop
+		self.record_time = 0.0
+		self.max_record_time = 0.0
+		self.stall_time = 0.0
+
+		self.writer = threading.Thread(target=self.write_chunks, daemon=True)
+		self.writer.start()
+		self.write_layout()
+
+		world.step_hooks.append(self.record)
+
+
+	def build_layout(self):
+		self.columns = ['step', 'time']
+
+		self.b2bodies = [b for b in self.world.b2world.bodies if b.type != b2_staticBody]
+		for k in range(len(self.b2bodies)):
+			self.columns += ['body%d.%s' % (k, v) for v in ('x', 'y', 'angle', 'vx', 'vy', 'w')]
+
+		self.tires = []
+		self.scans = []
+		for i, body in enumerate(self.world.bodies):
+			for j, tire in enumerate(getattr(body, 'tires', [])):
+				self.tires.append(tire)
+				self.columns.append('vehicle%d.tire%d.speed' % (i, j))
+			for name, scan in vars(body).items():
+				if isinstance(scan, LaserScan):
+					self.scans.append(scan)
+					self.columns += ['vehicle%d.%s%d' % (i, name, j) for j in range(len(scan.values))]
+
+	def write_layout(self):
+		layout = {'columns': self.columns,
+					'chunk_steps': self.chunk_steps,
+					'chunks': ['chunk_%05d.npy' % i for i in range(self.n_written_chunks)],
+					'n_records': self.n_written_records}
+		tmp_path = os.path.join(self.path, 'layout.json.tmp')
+		with open(tmp_path, 'w') as f:
+			json.dump(layout, f, indent=1)
+		os.replace(tmp_path, os.path.join(self.path, 'layout.json'))
+
+
+	def record(self, world, fw):
+		start = time.perf_counter()
+
+		values = [world.n_steps, fw.time]
+		for b in self.b2bodies:
+			position, velocity = b.position, b.linearVelocity
+			values += (position[0], position[1], b.angle, velocity[0], velocity[1], b.angularVelocity)
+		for tire in self.tires:
+			values.append(tire.body.GetWorldVector((0, 1)).dot(tire.body.linearVelocity))
+		for scan in self.scans:
+			values += scan.values.tolist()
+
+		self.chunk[self.n_rows] = values
+		self.n_rows += 1
+		self.n_records += 1
+		if self.n_rows == self.chunk_steps:
+			self.flush()
+
+		elapsed = time.perf_counter() - start
+		self.record_time += elapsed
+		self.max_record_time = max(self.max_record_time, elapsed)
+
+	def flush(self):
+		if self.n_rows == 0:
+			return
+		self.full.put((self.n_chunks, self.chunk, self.n_rows))
+		self.n_chunks += 1
+
+		stall = time.perf_counter()
+		self.chunk = self.free.get()
+		self.stall_time += time.perf_counter() - stall
+		self.n_rows = 0
+
+
+	def write_chunks(self):
+		while True:
+			item = self.full.get()
+			if item is None:
+				break
+			idx, chunk, n_rows = item
+			np.save(os.path.join(self.path, 'chunk_%05d.npy' % idx), chunk[:n_rows])
+			self.free.put(chunk)
+
+			# the layout only lists complete chunks, even if the run is interrupted
+			self.n_written_chunks = idx + 1
+			self.n_written_records += n_rows
+			self.write_layout()
+
+
+	def close(self):
+		if self.record in self.world.step_hooks:
+			self.world.step_hooks.remove(self.record)
+		self.flush()
+		self.full.put(None)
+		self.writer.join()
+		self.write_layout()
+
+	def stats(self):
+		# write cost per step, in the sim loop
+		n = max(self.n_records, 1)
+		return {'records': self.n_records,
+				'chunks': self.n_chunks,
+				'mean_us': self.record_time / n * 1e6,
+				'max_us': self.max_record_time * 1e6,
+				'stall_us': self.stall_time * 1e6}
+
+
+def load_trajectory(path, mmap = True, concatenate = False):
+	# column names and records of a recorded run: the list of the chunks,
+	# memory-mapped (nothing is read until used), or with concatenate=True
+	# a single array, read in memory
+	with open(os.path.join(path, 'layout.json')) as f:
+		layout = json.load(f)
+
+	chunks = [np.load(os.path.join(path, name), mmap_mode='r' if mmap else None) for name in layout['chunks']]
+	if not concatenate:
+		return layout['columns'], chunks
+	if not chunks:
+		return layout['columns'], np.zeros((0, len(layout['columns'])), dtype=np.float32)
+	return layout['columns'], np.concatenate(chunks)
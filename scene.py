@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from world import World, Wall, Maze
+from mazegen import generate_maze
+import numpy as np
+import importlib
+import hashlib
+import json
+import os
+import sys
+
+"""
+Declarative scenes: a JSON file listing the bodies of a world, in the order
+they are appended to world.bodies.
+
+	{"bodies": [
+		{"type": "Wall"},
+		{"type": "Wall", "boundary": [[-30,-30], [-30,20], [-20,20], [-20,-30], [-30,-30]]},
+		{"type": "Maze", "scale_ratio": 1.5},
+		{"type": "Ball", "position": [-30,-30], "radius": 1},
+		{"type": "ex_5.MyRover", "position": [0,0], "angle": 0,
+		 "sensors": {"laserscan": {"batched": true, "update_period": 0.1}}}
+	]}
+
+Types are the bodies of world.py and platforms.py, or module.Class for any
+other body; the other keys are given to the constructor, except sensors:
+settings of the LaserScans of the vehicle, applied once it is built. An
+optional "gravity": [x, y] sets the gravity of the world. A Maze entry with
+"generate": {"rows": 50, "columns": 50, "seed": 3} is built by
+mazegen.generate_maze (with scale_ratio 1 by default).
+
+The static geometry (scaled and validated edge chains of the walls and
+mazes) is prepared once and kept in a binary sidecar, scene.json.geometry,
+keyed by the hash of the static bodies of the scene, and in memory for the
+next loads in the same process.
+
+	world = load_scene('scenes/maze.json')
+	python scene.py scenes/maze.json [--headless]
+"""
+
+CACHE_VERSION = 2
+
+STATIC_TYPES = {'Wall': Wall, 'Maze': Maze}
+BODY_TYPES = {'Ball': 'world', 'Rover': 'platforms', 'KeyboardRover': 'platforms', 'KinematicRover': 'platforms'}
+SENSOR_SETTINGS = ('batched', 'visibility', 'skip_still', 'update_period')
+
+# hash: prepared static geometry
+_prepared = {}
+
+
+def body_class(name):
+	if name in BODY_TYPES:
+		module, name = BODY_TYPES[name], name
+	elif '.' in name:
+		module, name = name.rsplit('.', 1)
+	else:
+		raise ValueError('unknown body type %r' % name)
+	return getattr(importlib.import_module(module), name)
+
+
+def prepare(entry):
+	# arguments of the constructor of a static body, with prepared geometry
+	kws = {key: value for key, value in entry.items() if key != 'type'}
+	if 'generate' in kws:
+		# generated maze, see mazegen.py
+		kws['boundaries'], kws['start_line'], kws['end_line'] = generate_maze(**kws.pop('generate'))
+		kws.setdefault('scale_ratio', 1)
+	if entry['type'] == 'Wall':
+		return {'boundary': Wall.prepare(**kws), 'prepared': True}
+	boundaries, start_line, end_line = Maze.prepare(**kws)
+	return {'boundaries': boundaries, 'scale_ratio': kws.get('scale_ratio', 1.5),
+			'start_line': start_line, 'end_line': end_line, 'prepared': True}
+
+
+def static_key(entries):
+	text = json.dumps([CACHE_VERSION, entries], sort_keys=True)
+	return hashlib.sha1(text.encode()).hexdigest()
+
+
+def save_geometry(path, key, prepared):
+	# a JSON header (key, lengths of the chains, lines of the mazes) and all
+	# the vertices as raw float64
+	chains, header = [], {'key': key, 'chain_lengths': [], 'bodies': []}
+	for kws in prepared:
+		body_chains = [kws['boundary']] if 'boundary' in kws else kws['boundaries']
+		chains += body_chains
+		header['chain_lengths'] += [len(chain) for chain in body_chains]
+		header['bodies'].append({key: value for key, value in kws.items() if key not in ('boundary', 'boundaries')})
+		header['bodies'][-1]['n_chains'] = len(body_chains)
+
+	text = json.dumps(header).encode()
+	vertices = np.array([vertex for chain in chains for vertex in chain], dtype='<f8')
+	tmp_path = path + '.tmp'
+	with open(tmp_path, 'wb') as f:
+		f.write(len(text).to_bytes(8, 'little'))
+		f.write(text)
+		f.write(vertices.tobytes())
+	os.replace(tmp_path, path)
+
+
+def load_geometry(path, key):
+	# prepared static geometry of the sidecar, None if missing, stale,
+	# truncated or corrupt
+	try:
+		with open(path, 'rb') as f:
+			data = f.read()
+		size = int.from_bytes(data[:8], 'little')
+		header = json.loads(data[8:8 + size])
+		if header.get('key') != key:
+			return None
+
+		vertices = np.frombuffer(data, dtype='<f8', offset=8 + size).reshape(-1, 2).tolist()
+		lengths = header['chain_lengths']
+		if sum(lengths) != len(vertices):
+			return None
+		chains, start = [], 0
+		for n in lengths:
+			chains.append([tuple(v) for v in vertices[start:start + n]])
+			start += n
+
+		prepared = []
+		for kws in header['bodies']:
+			n = kws.pop('n_chains')
+			body_chains, chains = chains[:n], chains[n:]
+			if 'start_line' in kws:
+				kws['boundaries'] = body_chains
+				kws['start_line'] = [tuple(p) for p in kws['start_line']]
+				kws['end_line'] = [tuple(p) for p in kws['end_line']]
+			else:
+				kws['boundary'] = body_chains[0]
+			prepared.append(kws)
+	except (OSError, ValueError, KeyError, IndexError, TypeError, AttributeError):
+		return None
+	if chains:
+		# more chains than bodies
+		return None
+	return prepared
+
+
+def static_geometry(entries, path = None):
+	# prepared geometry of the static entries: from memory, from the
+	# sidecar of path, or prepared (and saved) again
+	key = static_key(entries)
+	if key in _prepared:
+		return _prepared[key]
+
+	sidecar = path + '.geometry' if path else None
+	prepared = load_geometry(sidecar, key) if sidecar else None
+	if prepared is None:
+		prepared = [prepare(entry) for entry in entries]
+		if sidecar:
+			try:
+				save_geometry(sidecar, key, prepared)
+			except OSError:
+				# read-only scenes are still loaded
+				pass
+	_prepared[key] = prepared
+	return prepared
+
+
+def configure_sensors(body, sensors):
+	for name, settings in sensors.items():
+		scan = getattr(body, name, None)
+		if scan is None:
+			raise ValueError('%s has no sensor %r' % (type(body).__name__, name))
+		for setting, value in settings.items():
+			if setting not in SENSOR_SETTINGS:
+				raise ValueError('unknown setting %r of sensor %r, expected one of %s' % (setting, name, SENSOR_SETTINGS))
+			if setting == 'update_period':
+				scan.set_update_period(value)
+			else:
+				setattr(scan, setting, value)
+
+
+def load_scene(scene, world = None):
+	# scene: path of a JSON file, or the scene itself as a dict; the bodies
+	# are appended to world (a new World by default), which is returned
+	path = None
+	if not isinstance(scene, dict):
+		path = scene
+		with open(path) as f:
+			scene = json.load(f)
+	if world is None:
+		world = World(gravity = tuple(scene.get('gravity', (0, 0))))
+
+	entries = scene['bodies']
+	static = [entry for entry in entries if entry['type'] in STATIC_TYPES]
+	prepared = iter(static_geometry(static, path))
+
+	for entry in entries:
+		if entry['type'] in STATIC_TYPES:
+			body = STATIC_TYPES[entry['type']](world, **next(prepared))
+		else:
+			kws = {key: value for key, value in entry.items() if key not in ('type', 'sensors')}
+			if 'position' in kws:
+				kws['position'] = tuple(kws['position'])
+			body = body_class(entry['type'])(world, **kws)
+			configure_sensors(body, entry.get('sensors', {}))
+		world.bodies.append(body)
+
+	return world
+
+
+if __name__ == "__main__":
+	from IO import Framework, HeadlessFramework
+
+	if len(sys.argv) < 2:
+		print('usage: python scene.py scene.json [--headless]')
+		sys.exit(1)
+	world = load_scene(sys.argv[1])
+	if '--headless' in sys.argv:
+		HeadlessFramework(sys.argv[1], world).run(duration=10.0)
+	else:
+		Framework(sys.argv[1], world).run()
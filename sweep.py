@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from race import run_race, default_maze_race, generated_maze_race
+from functools import partial
+import multiprocessing as mp
+import itertools
+import argparse
+import random
+import time
+import csv
+import os
+
+"""
+Parameter sweeps of the maze races of race.py, over named parameters:
+
+	world.VEL_ITERS, world.POS_ITERS     attributes of the World
+	tire.max_drive_force, tire.turn_torque, tire.max_lateral_impulse, ...
+	                                     attributes of each tire of the rover
+	rover.far_distance, rover.turn_rate, ...
+	                                     attributes of the rover (controller)
+
+A point of the sweep sets its parameters once the race is built, then runs
+one race per seed. grid(space) gives every combination of the values of
+space (name: [values]), random_points(space, n, seed) n points drawn from
+space (name: (low, high) or [values]).
+
+The races run over a process pool, and each one is appended to a CSV file as
+soon as it is done: one column per parameter, the seed, then the metrics of
+the race. An interrupted sweep is resumed by running it again with the same
+file: the (point, seed) pairs already in the file are not run again.
+
+	python sweep.py ex_5.MyRover -p rover.far_distance=15,20,25 -p world.VEL_ITERS=4,10 -o sweep.csv
+	python sweep.py ex_5.MyRover -p tire.max_drive_force=100:300 --random 50 --seeds 4 -o sweep.csv
+"""
+
+METRICS = ('finished', 'lap_time', 'start_time', 'end_time', 'distance', 'collisions', 'sim_time', 'elapsed_s')
+PARAMETER_TARGETS = ('world', 'tire', 'rover')
+
+
+def grid(space):
+	# every combination of the values of space: name: [values]
+	names = list(space)
+	return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_points(space, n, seed = 0):
+	# n points of space: name: (low, high), uniform (integers if both bounds
+	# are), or name: [values], one of them
+	rng = random.Random(seed)
+	points = []
+	for i in range(n):
+		point = {}
+		for name, values in space.items():
+			if isinstance(values, tuple):
+				low, high = values
+				if isinstance(low, int) and isinstance(high, int):
+					point[name] = rng.randint(low, high)
+				else:
+					point[name] = rng.uniform(low, high)
+			else:
+				point[name] = rng.choice(values)
+		points.append(point)
+	return points
+
+
+def set_parameter(world, rover, name, value):
+	target, _, attribute = name.partition('.')
+	if target not in PARAMETER_TARGETS:
+		raise ValueError('unknown parameter %r, expected one of %s followed by an attribute' % (name, PARAMETER_TARGETS))
+	objects = {'world': [world], 'tire': rover.tires, 'rover': [rover]}[target]
+	for obj in objects:
+		if not hasattr(obj, attribute):
+			raise ValueError('unknown parameter %r: %s has no attribute %r' % (name, type(obj).__name__, attribute))
+		setattr(obj, attribute, value)
+
+
+def with_parameters(make_race, point, seed):
+	# make_race(seed), with the parameters of point set
+	world, rover, maze = make_race(seed)
+	for name, value in point.items():
+		set_parameter(world, rover, name, value)
+	return world, rover, maze
+
+
+def _run(job):
+	make_race, point, seed, max_time = job
+	start = time.perf_counter()
+	result = run_race(partial(with_parameters, make_race, point), seed, max_time)
+	result['elapsed_s'] = time.perf_counter() - start
+	row = dict(point)
+	row['seed'] = seed
+	row.update((metric, result[metric]) for metric in METRICS)
+	return row
+
+
+
+def row_key(row, names):
+	# (point, seed) as written in the CSV file
+	return tuple(str(row[name]) for name in names) + (str(row['seed']),)
+
+
+def completed(path, columns):
+	# keys of the races already in the results file
+	if not os.path.exists(path):
+		return set()
+	with open(path, newline='') as f:
+		reader = csv.DictReader(f)
+		if reader.fieldnames is not None and reader.fieldnames != columns:
+			raise ValueError('%s has the columns %s, not the ones of this sweep %s' % (path, reader.fieldnames, columns))
+		return {row_key(row, columns[:columns.index('seed')]) for row in reader}
+
+
+def sweep(make_race, points, seeds, path, max_time = 120.0, processes = None):
+	# runs the races of points x seeds not yet in the CSV file of path,
+	# appending each one as soon as it is done; returns the number run
+	names = list(points[0]) if points else []
+	columns = names + ['seed'] + list(METRICS)
+	done = completed(path, columns)
+	jobs = [(make_race, point, seed, max_time) for point in points for seed in seeds
+			if row_key(dict(point, seed=seed), names) not in done]
+	if not jobs:
+		return 0
+
+	new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+	with open(path, 'a', newline='') as f, mp.Pool(processes) as pool:
+		writer = csv.DictWriter(f, columns)
+		if new_file:
+			writer.writeheader()
+		for row in pool.imap_unordered(_run, jobs):
+			writer.writerow(row)
+			# a complete row survives an interruption
+			f.flush()
+	return len(jobs)
+
+
+
+def parse_value(text):
+	for kind in (int, float):
+		try:
+			return kind(text)
+		except ValueError:
+			pass
+	return text
+
+
+def parse_parameter(text):
+	# name=v1,v2,... (values) or name=low:high (range, random search only)
+	name, _, values = text.partition('=')
+	if not values:
+		raise argparse.ArgumentTypeError('expected name=v1,v2,... or name=low:high, not %r' % text)
+	if ':' in values:
+		low, high = values.split(':', 1)
+		return name, (parse_value(low), parse_value(high))
+	return name, [parse_value(value) for value in values.split(',')]
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description='Sweep controller and physics parameters over maze races')
+	parser.add_argument('rover', help='rover class, as module.Class')
+	parser.add_argument('-p', '--parameter', type=parse_parameter, action='append', default=[],
+						help='name=v1,v2,... or name=low:high, e.g. tire.max_drive_force=100:300')
+	parser.add_argument('--random', type=int, default=None, help='random search of this many points instead of the grid')
+	parser.add_argument('--sweep-seed', type=int, default=0, help='seed of the random search')
+	parser.add_argument('--seeds', type=int, default=4, help='races per point')
+	parser.add_argument('--maze', choices=('default', 'generated'), default='default')
+	parser.add_argument('--max-time', type=float, default=120.0, help='simulated seconds per race')
+	parser.add_argument('--processes', type=int, default=None)
+	parser.add_argument('-o', '--output', default='sweep.csv')
+	args = parser.parse_args()
+
+	space = dict(args.parameter)
+	if args.random is not None:
+		points = random_points(space, args.random, args.sweep_seed)
+	else:
+		ranges = [name for name, values in space.items() if isinstance(values, tuple)]
+		if ranges:
+			parser.error('ranges (%s) need --random' % ', '.join(ranges))
+		points = grid(space)
+
+	make_race = partial(default_maze_race if args.maze == 'default' else generated_maze_race, args.rover)
+	n = sweep(make_race, points, range(args.seeds), args.output, args.max_time, args.processes)
+	print('%d of %d races run, results in %s' % (n, len(points) * args.seeds, args.output))
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the modules of the simulator are at the root of the repository, and
+# pygame runs without a display
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
@@ -0,0 +1,26 @@
+from world import World, Wall, Maze
+
+
+def edges(chains):
+	return sum(len(chain) - 1 for chain in chains)
+
+
+def test_wall_has_one_fixture_per_edge():
+	world = World()
+	wall = Wall(world, boundary=[(-30,-30), (-30,+20), (-20,+20), (-20,-30), (-30,-30)])
+	assert len(wall.b2body.fixtures) == edges([wall.boundary])
+
+
+def test_maze_has_one_fixture_per_edge():
+	world = World()
+	maze = Maze(world)
+	assert len(maze.b2body.fixtures) == edges(maze.boundaries) == 51
+
+
+def test_generated_maze_has_one_fixture_per_edge():
+	from mazegen import generate_maze
+
+	world = World()
+	boundaries, start_line, end_line = generate_maze(100, 100, seed=0)
+	maze = Maze(world, boundaries, scale_ratio=1, start_line=start_line, end_line=end_line)
+	assert len(maze.b2body.fixtures) == edges(maze.boundaries)
@@ -0,0 +1,20 @@
+import numpy as np
+
+from env import RoverEnv, make_arena
+
+
+def run_episode(env, actions):
+	env.reset()
+	for scan in (env.rover.laserscan, env.rover.front_ir, env.rover.rear_ir):
+		scan.skip_still = False
+	return np.array([env.step(action)[0].copy() for action in actions])
+
+
+def test_consecutive_resets_give_the_same_episode():
+	env = RoverEnv(make_arena, seed=0, max_steps=300)
+	rng = np.random.default_rng(1)
+	actions = [(5.0, 5 * rng.standard_normal()) for _ in range(300)]
+
+	episodes = [run_episode(env, actions) for _ in range(4)]
+	for episode in episodes[1:]:
+		np.testing.assert_array_equal(episode, episodes[0])
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@author: Salvatore Anzalone
+@organization: CHArt - Université Paris 8
+"""
+from IO import HeadlessFramework
+from multiprocessing import shared_memory, resource_tracker
+import multiprocessing as mp
+import numpy as np
+import random
+import traceback
+
+"""
+N independent worlds stepped in worker processes.
+
+Each worker builds its world with make_world(seed), a picklable function
+returning (world, rover), runs it headless and writes the rover observations
+into its row of a shared memory block: the parent reads them without any
+pickling. Workers are stepped all together (step) or independently
+(step_async / step_wait).
+
+Observation row: laser | front_ir | rear_ir | pose (x, y, angle)
+"""
+
+def observation_sizes(rover):
+	return [('laser', len(rover.laserscan.values)),
+			('front_ir', len(rover.front_ir.values)),
+			('rear_ir', len(rover.rear_ir.values)),
+			('pose', 3)]
+
+
+def observe(rover, out):
+	n_laser = len(rover.laserscan.values)
+	n_front = len(rover.front_ir.values)
+	n_rear = len(rover.rear_ir.values)
+
+	out[:n_laser] = rover.laserscan.values
+	out[n_laser:n_laser + n_front] = rover.front_ir.values
+	out[n_laser + n_front:n_laser + n_front + n_rear] = rover.rear_ir.values
+	position = rover.b2body.position
+	out[-3:] = (position[0], position[1], rover.b2body.angle)
+
+
+def seed_everything(seed):
+	random.seed(seed)
+	np.random.seed(seed)
+
+
+def worker(idx, make_world, seed, conn):
+	try:
+		seed_everything(seed)
+		world, rover = make_world(seed)
+		fw = HeadlessFramework('worker %d' % idx, world)
+		conn.send(('ready', observation_sizes(rover)))
+
+		command, name, n_envs = conn.recv()
+		shm = shared_memory.SharedMemory(name=name)
+		size = sum(n for _, n in observation_sizes(rover)) + 1
+		observations = np.ndarray((n_envs, size), dtype=np.float32, buffer=shm.buf)
+		row = observations[idx]
+		observe(rover, row[:-1])
+
+		while True:
+			command, arg = conn.recv()
+			if command == 'step':
+				fw.run(steps=arg, verbose=False)
+			elif command == 'reset':
+				seed_everything(arg)
+				world, rover = make_world(arg)
+				fw = HeadlessFramework('worker %d' % idx, world)
+			elif command == 'close':
+				break
+
+			observe(rover, row[:-1])
+			row[-1] = fw.steps * fw.TIMESTEP
+			conn.send(('done', None))
+
+		del observations, row
+		shm.close()
+
+	except Exception:
+		conn.send(('error', traceback.format_exc()))
+
+
+class VecWorld():
+
+	def __init__(self, make_world, n_envs, seeds = None, context = None):
+		self.n_envs = n_envs
+		self.seeds = seeds
+		if self.seeds is None:
+			self.seeds = list(range(n_envs))
+
+		# workers share the resource tracker of the parent, which owns the
+		# shared memory block: otherwise they would unlink it when exiting
+		resource_tracker.ensure_running()
+
+		ctx = mp.get_context(context)
+		self.conns = []
+		self.processes = []
+		for idx in range(n_envs):
+			parent_conn, child_conn = ctx.Pipe()
+			process = ctx.Process(target=worker, args=(idx, make_world, self.seeds[idx], child_conn), daemon=True)
+			process.start()
+			self.conns.append(parent_conn)
+			self.processes.append(process)
+
+		# all the workers must report the same observation layout
+		layouts = [self.receive(conn) for conn in self.conns]
+		if any(layout != layouts[0] for layout in layouts):
+			self.close()
+			raise ValueError('Workers report different observation layouts: ' + str(layouts))
+
+		self.layout = {}
+		offset = 0
+		for name, n in layouts[0]:
+			self.layout[name] = slice(offset, offset + n)
+			offset += n
+		self.obs_size = offset
+
+		# one row per world: the observation, then its simulated time
+		self.shm = shared_memory.SharedMemory(create=True, size=n_envs * (self.obs_size + 1) * 4)
+		self.buffer = np.ndarray((n_envs, self.obs_size + 1), dtype=np.float32, buffer=self.shm.buf)
+		self.buffer[:] = 0
+		self.observations = self.buffer[:, :-1]
+		self.times = self.buffer[:, -1]
+
+		for conn in self.conns:
+			conn.send(('attach', self.shm.name, n_envs))
+		self.pending = set()
+
+
+	def __getitem__(self, name):
+		# view over one field of all the observations, e.g. vec['laser']
+		return self.observations[:, self.layout[name]]
+
+	def receive(self, conn):
+		status, payload = conn.recv()
+		if status == 'error':
+			raise RuntimeError('Worker failed:\n' + payload)
+		return payload
+
+	def envs(self, envs):
+		return range(self.n_envs) if envs is None else envs
+
+
+	def step_async(self, n_steps = 1, envs = None):
+		for idx in self.envs(envs):
+			if idx in self.pending:
+				raise RuntimeError('World %d is still stepping' % idx)
+			self.conns[idx].send(('step', n_steps))
+			self.pending.add(idx)
+
+	def step_wait(self, envs = None):
+		for idx in self.envs(envs):
+			if idx in self.pending:
+				self.receive(self.conns[idx])
+				self.pending.discard(idx)
+		return self.observations
+
+	def ready(self):
+		# worlds done stepping, whose observations can be read
+		return [idx for idx in sorted(self.pending) if self.conns[idx].poll()]
+
+	def step(self, n_steps = 1):
+		self.step_async(n_steps)
+		return self.step_wait()
+
+	def reset(self, seeds = None):
+		self.step_wait()
+		if seeds is not None:
+			self.seeds = list(seeds)
+		for conn, seed in zip(self.conns, self.seeds):
+			conn.send(('reset', seed))
+		for conn in self.conns:
+			self.receive(conn)
+		return self.observations
+
+
+	def close(self):
+		for idx, conn in enumerate(self.conns):
+			try:
+				if idx in self.pending:
+					conn.recv()
+				conn.send(('close', None))
+			except (BrokenPipeError, EOFError):
+				pass
+		for process in self.processes:
+			process.join()
+
+		self.pending = set()
+		self.conns = []
+		self.processes = []
+		if getattr(self, 'shm', None) is not None:
+			self.observations = self.times = self.buffer = None
+			self.shm.close()
+			self.shm.unlink()
+			self.shm = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+
+
+# Example: the controller of ex_5 in the three walls arena, random starting poses
+def make_arena(seed):
+	from world import World, Wall
+	from ex_5 import MyRover
+
+	rng = np.random.default_rng(seed)
+	world = World()
+	world.bodies.append( Wall( world) )
+	world.bodies.append( Wall( world, boundary=[(-30,-30), (-30,+20), (-20,+20), (-20,-30), (-30,-30)] ) )
+	world.bodies.append( Wall( world, boundary=[(+30,+30), (+30,-20), (+20,-20), (+20,+30), (+30,+30)] ) )
+
+	x = rng.choice([-50.0, 0.0, +50.0])
+	rover = MyRover( world, position=(x, rng.uniform(-10, 50)), angle=rng.uniform(-np.pi, np.pi))
+	world.bodies.append( rover )
+	return world, rover
+
+
+if __name__ == "__main__":
+	import time
+
+	n_envs = mp.cpu_count()
+	with VecWorld(make_arena, n_envs) as vec:
+		start = time.perf_counter()
+		for i in range(10):
+			vec.step(60)
+		elapsed = time.perf_counter() - start
+
+		print('%d worlds, %.1f steps/s in total' % (n_envs, n_envs * 600 / elapsed))
+		print('mean pose:', vec['pose'].mean(axis=0), 'simulated time:', vec.times[0])
@@ -7,6 +7,8 @@
 from Box2D import b2
 from Box2D import (b2Body, b2World, b2Vec2)
 import numpy as np
+import math
+import time
 
 """
 Vehicle based on Chris Campbell's tutorial from iforce2d.net:
@@ -33,6 +35,10 @@ class Tire():
 		self.body = world.CreateDynamicBody(position=position, angle=angle)
 		self.body.CreatePolygonFixture(box=dimensions, density=density)
 		self.body.userData = {'obj': self}
+		self.draw_vertices = [np.array(fixture.shape.vertices) for fixture in self.body.fixtures]
+		# TireFleet updating this tire with the others, if any
+		self.fleet = None
+		self.fleet_index = None
 
 	@property
 	def forward_velocity(self):
@@ -67,6 +73,10 @@ class Tire():
 							 self.body.worldCenter, True)
 
 	def update_drive(self, desired_speed):
+		if self.fleet is not None and self.fleet.stepping:
+			self.fleet.update_drive(self.fleet_index, desired_speed)
+			return
+
 		# find the current speed in the forward direction
 		current_forward_normal = self.body.GetWorldVector((0, 1))
 		current_speed = self.forward_velocity.dot(current_forward_normal)
@@ -84,6 +94,99 @@ class Tire():
 							 self.body.worldCenter, True)
 
 
+class TireFleet():
+	# Friction and drive of all the tires of a world, in NumPy arrays:
+	#
+	#	world.tire_fleet = TireFleet(world)
+	#
+	# Same physics as Tire.update_friction and Tire.update_drive. Before the
+	# bodies step, the velocities of all the tires are read at once, and the
+	# lateral impulses (clamped) and the angular damping are computed
+	# together. update_drive then only accumulates drive forces. After the
+	# bodies step, drag and drive forces are folded into the velocities
+	# (v += h * F / m, as Box2D integrates forces), written once per tire.
+	# Out of the step of the world, update_drive applies its force as usual.
+
+	def __init__(self, world):
+		self.world = world
+		self.tires = []
+		self.n_bodies = None
+		self.n_world_bodies = None
+		# between update_friction and apply
+		self.stepping = False
+
+	def refresh(self):
+		# the tires of the vehicles of the world, gathered again when bodies
+		# are added or removed
+		if self.n_bodies == len(self.world.bodies) and self.n_world_bodies == self.world.b2world.bodyCount:
+			return
+		for tire in self.tires:
+			tire.fleet = tire.fleet_index = None
+
+		self.tires = [tire for body in self.world.bodies for tire in getattr(body, 'tires', []) if isinstance(tire, Tire)]
+		for idx, tire in enumerate(self.tires):
+			tire.fleet = self
+			tire.fleet_index = idx
+		self.b2bodies = [tire.body for tire in self.tires]
+		self.mass = np.array([b.mass for b in self.b2bodies])
+		self.has_inertia = np.array([b.inertia > 0 for b in self.b2bodies])
+
+		self.n_bodies = len(self.world.bodies)
+		self.n_world_bodies = self.world.b2world.bodyCount
+
+	def update_friction(self):
+		self.refresh()
+		n = len(self.tires)
+		state = np.array([(b.angle, b.linearVelocity[0], b.linearVelocity[1], b.angularVelocity, b.awake)
+							for b in self.b2bodies]).reshape(n, 5)
+		traction = np.array([tire.current_traction for tire in self.tires], dtype=float)
+		max_impulse = np.array([tire.max_lateral_impulse for tire in self.tires], dtype=float)
+
+		angle, velocity, angular_velocity = state[:, 0], state[:, 1:3], state[:, 3]
+		self.asleep = np.flatnonzero(state[:, 4] == 0).tolist()
+		c, s = np.cos(angle), np.sin(angle)
+		self.forward = np.column_stack((-s, c))
+		right = np.column_stack((c, s))
+
+		# lateral impulse, clamped
+		impulse = -(velocity * right).sum(axis=1) * self.mass
+		impulse = np.clip(impulse, -max_impulse, max_impulse)
+		self.velocity = velocity + (traction * impulse / self.mass)[:, None] * right
+
+		# angular damping
+		self.angular_velocity = np.where(self.has_inertia, angular_velocity - 0.1 * traction * angular_velocity, angular_velocity)
+
+		# drag, along the forward direction; the lateral impulse leaves the
+		# forward speed unchanged
+		forward_speed = (velocity * self.forward).sum(axis=1)
+		self.forces = -2 * traction * forward_speed
+		self.forward_speed = forward_speed.tolist()
+		self.drive_forces = [0.0] * n
+		self.stepping = True
+
+	def update_drive(self, idx, desired_speed):
+		current_speed = self.forward_speed[idx]
+		if desired_speed > current_speed:
+			force = self.tires[idx].max_drive_force
+		elif desired_speed < current_speed:
+			force = -self.tires[idx].max_drive_force
+		else:
+			return
+		self.drive_forces[idx] += self.tires[idx].current_traction * force
+
+	def apply(self, timestep):
+		self.stepping = False
+		forces = self.forces + np.array(self.drive_forces)
+		velocity = self.velocity + (timestep * forces / self.mass)[:, None] * self.forward
+
+		# forces and impulses wake the bodies up, as Apply* do
+		for idx in self.asleep:
+			self.b2bodies[idx].awake = True
+		for b, v, w in zip(self.b2bodies, velocity.tolist(), self.angular_velocity.tolist()):
+			b.linearVelocity = v
+			b.angularVelocity = w
+
+
 class Vehicle():
 	__default_vertices = [(1.5, 0.0),
 				(3.0, 2.5),
@@ -112,11 +215,16 @@ class Vehicle():
 		self.b2body = world.b2world.CreateDynamicBody(position=position, angle=angle)
 		self.b2body.CreatePolygonFixture(vertices=self.vertices, density=density)
 		self.b2body.userData = {'obj': self}
+		self.draw_vertices = np.array(self.vertices)
 
 		self.tires_anchors = tires_anchors
 		if self.tires_anchors is None:
 			self.tires_anchors = Vehicle.__default_tires_anchors
 
+		self.create_tires(angle, **tire_kws)
+
+	def create_tires(self, angle, **tire_kws):
+		world = self.world
 		self.tires = [Tire(self,
 							 position=self.b2body.transform * self.tires_anchors[i],
 							 angle=angle,
@@ -141,21 +249,105 @@ class Vehicle():
 			joints.append(j)
 			
 	def step(self, fw):
-		for tire in self.tires:
-			tire.update_friction()
+		profiler = self.world.profiler
+		if profiler is not None:
+			start = time.perf_counter()
+
+		if self.world.tire_fleet is None:
+			for tire in self.tires:
+				tire.update_friction()
+
+		if profiler is not None:
+			profiler.add('friction', time.perf_counter() - start)
 			
 
 	def draw(self, fw):
-		transform = self.b2body.transform
-		vertices = [transform * v for v in self.vertices]
-
-		fw.DrawPolygon( vertices, (255, 255, 255, 255))
+		fw.DrawBodyPolygon( self.b2body, self.draw_vertices, (255, 255, 255, 255))
 		
 		for tire in self.tires:
-			for fixture in tire.body.fixtures:
-				transform = tire.body.transform
-				vertices = [transform * v for v in fixture.shape.vertices]
-				fw.DrawPolygon( vertices, (255, 255, 255, 255))
+			for vertices in tire.draw_vertices:
+				fw.DrawBodyPolygon( tire.body, vertices, (255, 255, 255, 255))
 
 
-				
+
+class KinematicTire():
+	# Wheel of a KinematicVehicle: no body, no joint, no friction. The speed
+	# given to update_drive is the speed of the wheel, reached at once.
+
+	def __init__(self, car, anchor, max_forward_speed=50.0,
+				 max_backward_speed=-25, max_drive_force=150,
+				 turn_torque=15, max_lateral_impulse=3,
+				 dimensions=(0.5, 1.25), **kws):
+		self.car = car
+		self.anchor = anchor
+		self.max_forward_speed = max_forward_speed
+		self.max_backward_speed = max_backward_speed
+		self.max_drive_force = max_drive_force
+		self.turn_torque = turn_torque
+		self.max_lateral_impulse = max_lateral_impulse
+		self.current_traction = 1
+		self.speed = 0.0
+
+		# drawn as a part of the chassis
+		self.body = car.b2body
+		w, h = dimensions
+		self.draw_vertices = [np.array([(-w, -h), (+w, -h), (+w, +h), (-w, +h)]) + anchor]
+
+	@property
+	def forward_velocity(self):
+		current_normal = self.body.GetWorldVector((0, 1))
+		return current_normal.dot(self.body.GetLinearVelocityFromLocalPoint(self.anchor)) * current_normal
+
+	@property
+	def lateral_velocity(self):
+		right_normal = self.body.GetWorldVector((1, 0))
+		return right_normal.dot(self.body.GetLinearVelocityFromLocalPoint(self.anchor)) * right_normal
+
+	def update_friction(self):
+		pass
+
+	def update_drive(self, desired_speed):
+		self.speed = desired_speed
+		self.car.update_velocity()
+
+
+class KinematicVehicle(Vehicle):
+	# Differential drive without tire dynamics: the chassis is still a
+	# dynamic body (it collides with walls and carries the gripper), but its
+	# velocity is set from the speeds of the wheels, at each drive command
+	# and at each step. The wheels keep the last speed they were given.
+	# Mixed in before Vehicle, e.g. class MyKinematicRover(MyRover, KinematicVehicle)
+
+	def create_tires(self, angle, **tire_kws):
+		self.tires = [KinematicTire(self, anchor, **tire_kws) for anchor in self.tires_anchors]
+		self.joints = []
+
+		# forward speed of the wheels: speed + angular_speed * x (body frame),
+		# fitted by least squares when there are more than two wheels
+		x = [float(anchor[0]) for anchor in self.tires_anchors]
+		self.mean_x = sum(x) / len(x)
+		self.offsets_x = [xi - self.mean_x for xi in x]
+		self.spread_x = sum(offset * offset for offset in self.offsets_x)
+		self.local_center = tuple(self.b2body.localCenter)
+
+	def update_velocity(self):
+		# plain floats: called at each drive command, for every vehicle
+		tires = self.tires
+		angular_speed = 0.0
+		if self.spread_x > 0:
+			angular_speed = sum(offset * tire.speed for offset, tire in zip(self.offsets_x, tires)) / self.spread_x
+		speed = sum(tire.speed for tire in tires) / len(tires) - angular_speed * self.mean_x
+
+		# velocity of the center of mass, from the one of the body origin
+		body = self.b2body
+		angle = body.angle
+		c, s = math.cos(angle), math.sin(angle)
+		x, y = self.local_center
+		center_x, center_y = c * x - s * y, s * x + c * y
+		body.linearVelocity = (-s * speed - angular_speed * center_y,
+								c * speed + angular_speed * center_x)
+		body.angularVelocity = angular_speed
+
+	def step(self, fw):
+		# along the new heading, and after the collisions of the last step
+		self.update_velocity()
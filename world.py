@@ -5,8 +5,14 @@
 @organization: CHArt - Université Paris 8
 """
 from Box2D import b2
-from Box2D import (b2CircleShape, b2FixtureDef, b2Vec2)
+from Box2D import (b2CircleShape, b2FixtureDef, b2Vec2, b2_staticBody)
 import numpy as np
+import math
+import time
+from raycast import WorldGeometry
+from laserscan import LaserScan, ScanHistory, SensorBuffer
+from fork import WorldFork
+from vehicle import KinematicTire
 
 class World():
 	VEL_ITERS, POS_ITERS = 10, 10
@@ -15,39 +21,325 @@ class World():
 		self.b2world = b2.world()
 		self.bodies = []
 		self.b2world.gravity = gravity
+		self.n_steps = 0
+		self.geometry = WorldGeometry(self)
+		# readings of all the laser scans
+		self.sensors = SensorBuffer(self)
+		# called as hook(world, fw) after each step (recorders, monitors...)
+		self.step_hooks = []
+		# number of sensors registered for each update period
+		self.sensor_phases = {}
+		# profiler.Profiler, timing the phases of the steps (None: disabled)
+		self.profiler = None
+		# True after a restore: the next step runs without warm starting
+		self.cold_start = False
+		# vehicle.TireFleet, updating all the tires at once (None: each
+		# vehicle updates its tires)
+		self.tire_fleet = None
 		
 
 	def step( self, fw):
+		if self.profiler is not None:
+			self.profiled_step(fw)
+			return
+
+		fleet = self.tire_fleet
+		if fleet is not None:
+			fleet.update_friction()
+		self.sensors.fill(fw)
+
 		for body in self.bodies:
 			body.step(fw)
 
+		if fleet is not None:
+			fleet.apply(fw.TIMESTEP)
+
 		self.b2world.Step(fw.TIMESTEP, self.VEL_ITERS, self.POS_ITERS)
 		self.b2world.ClearForces()
+		self.n_steps += 1
+		if self.cold_start:
+			self.end_cold_start()
+
+		for hook in self.step_hooks:
+			hook(self, fw)
+
+	def profiled_step( self, fw):
+		# same as step, timing each body and each phase
+		profiler = self.profiler
+		clock = time.perf_counter
+
+		# the friction of a tire fleet and the batched scans are counted in
+		# the bodies time, end_step takes them out of the controller time
+		fleet = self.tire_fleet
+		fleet_time = 0.0
+		if fleet is not None:
+			start = clock()
+			fleet.update_friction()
+			fleet_time += clock() - start
+		start = clock()
+		self.sensors.fill(fw)
+		fill_time = clock() - start
+
+		bodies_start = clock()
+		for body in self.bodies:
+			start = clock()
+			body.step(fw)
+			profiler.add_body(body, clock() - start)
+		bodies_time = clock() - bodies_start
+
+		if fleet is not None:
+			start = clock()
+			fleet.apply(fw.TIMESTEP)
+			fleet_time += clock() - start
+			profiler.add('friction', fleet_time)
+
+		start = clock()
+		self.b2world.Step(fw.TIMESTEP, self.VEL_ITERS, self.POS_ITERS)
+		self.b2world.ClearForces()
+		profiler.add('physics', clock() - start)
+		self.n_steps += 1
+		if self.cold_start:
+			self.end_cold_start()
+
+		start = clock()
+		for hook in self.step_hooks:
+			hook(self, fw)
+		profiler.add('hooks', clock() - start)
+
+		profiler.end_step(bodies_time + fleet_time + fill_time)
 		
 
-	def draw( self, fw):
+	def dynamic_b2bodies( self):
+		return [b for b in self.b2world.bodies if b.type != b2_staticBody]
+
+	def snapshot( self):
+		# state of the dynamic bodies, of the joint motors, of the sensors
+		# (laser scans and their histories), of the kinematic wheels and of
+		# the controllers (bodies with get_state/set_state), to be
+		# given back to restore. Static bodies are left out.
+		bodies = np.array([(b.position[0], b.position[1], b.angle,
+							b.linearVelocity[0], b.linearVelocity[1], b.angularVelocity, b.awake)
+							for b in self.dynamic_b2bodies()]).reshape(-1, 7)
+		motors = np.array([getattr(j, 'motorSpeed', 0.0) for j in self.b2world.joints])
+
+		states = []
+		for body in self.bodies:
+			scans = {name: scan.get_state() for name, scan in vars(body).items() if isinstance(scan, (LaserScan, ScanHistory))}
+			state = body.get_state() if hasattr(body, 'get_state') else None
+			# the kinematic wheels keep their last command (see KinematicVehicle)
+			speeds = [tire.speed for tire in getattr(body, 'tires', []) if isinstance(tire, KinematicTire)]
+			states.append((scans, state, speeds))
+
+		return {'n_steps': self.n_steps, 'bodies': bodies, 'motors': motors, 'states': states}
+
+	def restore( self, snapshot):
+		# the world must have the same bodies and joints as when the
+		# snapshot was taken
+		b2bodies = self.dynamic_b2bodies()
+		joints = list(self.b2world.joints)
+		if len(b2bodies) != len(snapshot['bodies']) or len(joints) != len(snapshot['motors']) \
+				or len(self.bodies) != len(snapshot['states']):
+			raise ValueError('The snapshot was taken from a different world')
+
+		# as in a new world, the contacts are dropped (with the bodies
+		# deactivated) and the impulses of the joints are not warm started.
+		# Box2D reuses the freed proxies last in, first out: deactivated in
+		# reverse order, the bodies get back the same proxies at each
+		# restore, and the contacts are found in the same order
+		for b in reversed(b2bodies):
+			b.active = False
+		for b, (x, y, angle, vx, vy, w, awake) in zip(b2bodies, snapshot['bodies'].tolist()):
+			b.active = True
+			b.transform = ((x, y), angle)
+			b.awake = False
+			b.awake = bool(awake)
+			b.linearVelocity = (vx, vy)
+			b.angularVelocity = w
+		for j, speed in zip(joints, snapshot['motors'].tolist()):
+			if hasattr(j, 'motorSpeed'):
+				j.motorSpeed = speed
+		self.b2world.ClearForces()
+		self.b2world.warmStarting = False
+		self.cold_start = True
+
+		for body, (scans, state, speeds) in zip(self.bodies, snapshot['states']):
+			for name, scan_state in scans.items():
+				getattr(body, name).set_state(scan_state)
+			if speeds:
+				for tire, speed in zip(body.tires, speeds):
+					tire.speed = speed
+			if state is not None:
+				body.set_state(state)
+
+		self.n_steps = snapshot['n_steps']
+		self.geometry.invalidate()
+
+	def end_cold_start( self):
+		self.b2world.warmStarting = True
+		self.cold_start = False
+
+	def fork( self, rollout, *args):
+		# runs rollout(world, fw, *args) on a copy-on-write copy of the world,
+		# in a child process (see fork.py); result() returns its return value
+		return WorldFork(self, rollout, *args)
+
+
+	def next_sensor_phase( self, update_period):
+		# sensors sharing an update period get consecutive phases, so that
+		# their updates are spread over the steps of the period
+		phase = self.sensor_phases.get(update_period, 0)
+		self.sensor_phases[update_period] = phase + 1
+		return phase
+
+	def sensor_due( self, update_period, phase, fw):
+		# update_period in seconds, None: at every step
+		if update_period is None:
+			return True
+		period = max(1, int(round(update_period / fw.TIMESTEP)))
+		return (self.n_steps + phase) % period == 0
+
+
+	def draw( self, fw, static = None):
+		# static: True draws only the static bodies (Wall, Maze...),
+		# False only the other ones, None all of them
 		for body in self.bodies:
-			body.draw(fw)
+			if static is None or getattr(body, 'is_static', False) == static:
+				body.draw(fw)
+
+
+def validate_chain(vertices):
+	# vertices of an edge chain as a list of (x, y) floats; raises
+	# ValueError if Box2D would reject it
+	chain = [(float(x), float(y)) for x, y in vertices]
+	if len(chain) < 2:
+		raise ValueError('an edge chain needs at least 2 vertices, got %d' % len(chain))
+	if not np.all(np.isfinite(chain)):
+		raise ValueError('non finite vertex in edge chain %s' % (chain,))
+	for a, b in zip(chain[:-1], chain[1:]):
+		if a == b:
+			raise ValueError('repeated vertex %s in edge chain' % (a,))
+	return chain
+
+
+def create_edges(b2body, chain):
+	# one edge fixture per edge of a validated chain: CreateEdgeChain of
+	# pybox2d adds a zero length edge to each chain, a useless proxy
+	for a, b in zip(chain[:-1], chain[1:]):
+		b2body.CreateEdgeFixture(vertices=[a, b])
+
+
+def optimize_chains(chains, tolerance = 0.01):
+	# same walls with fewer edges: vertices closer than tolerance are snapped
+	# together (across chains), then each chain loses its repeated vertices,
+	# its edges shorter than tolerance and the middle vertices of its
+	# collinear runs; chains reduced to a point are dropped
+	chains = snap_vertices(chains, tolerance)
+	chains = [merge_collinear(chain, tolerance) for chain in chains]
+	return [chain for chain in chains if len(chain) >= 2]
+
+
+def snap_vertices(chains, tolerance):
+	# each vertex is replaced by the first vertex seen within tolerance,
+	# found through a grid of tolerance wide cells
+	cells = {}
+	snapped = []
+	for chain in chains:
+		snapped_chain = []
+		for x, y in chain:
+			ix, iy = int(math.floor(x / tolerance)), int(math.floor(y / tolerance))
+			vertex = None
+			for cell in ((ix + dx, iy + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)):
+				for other in cells.get(cell, ()):
+					if (other[0] - x) ** 2 + (other[1] - y) ** 2 <= tolerance ** 2:
+						vertex = other
+						break
+				if vertex is not None:
+					break
+			if vertex is None:
+				vertex = (float(x), float(y))
+				cells.setdefault((ix, iy), []).append(vertex)
+			snapped_chain.append(vertex)
+		snapped.append(snapped_chain)
+	return snapped
+
+
+def collinear(a, b, c, tolerance):
+	# True if b lies on the segment a-c, within tolerance
+	ex, ey = c[0] - a[0], c[1] - a[1]
+	wx, wy = b[0] - a[0], b[1] - a[1]
+	length2 = ex * ex + ey * ey
+	if length2 == 0:
+		return False
+	along = wx * ex + wy * ey
+	return 0 <= along <= length2 and (wx * ey - wy * ex) ** 2 <= tolerance ** 2 * length2
+
+
+def merge_collinear(chain, tolerance):
+	closed = len(chain) > 2 and chain[0] == chain[-1]
+
+	# edges shorter than tolerance: the end of an open chain is kept
+	points = []
+	for p in chain:
+		if points and (p[0] - points[-1][0]) ** 2 + (p[1] - points[-1][1]) ** 2 < tolerance ** 2:
+			if len(points) > 1 and p is chain[-1] and not closed:
+				points[-1] = p
+			continue
+		points.append(p)
+
+	kept = []
+	for p in points:
+		while len(kept) >= 2 and collinear(kept[-2], kept[-1], p, tolerance):
+			kept.pop()
+		kept.append(p)
+
+	if closed:
+		# the first vertex may be in the middle of the last run
+		if len(kept) > 1 and kept[0] == kept[-1]:
+			kept.pop()
+		while len(kept) >= 3 and collinear(kept[-1], kept[0], kept[1], tolerance):
+			kept.pop(0)
+		while len(kept) >= 3 and collinear(kept[-2], kept[-1], kept[0], tolerance):
+			kept.pop()
+		if len(kept) < 3:
+			# a wall traced back and forth
+			return kept
+		kept.append(kept[0])
+	return kept
 
 
 class Wall():
+	# never moves: drawn once in the cached background of the framework
+	is_static = True
+
 	__default_boundary = [(-70, -50),
 							(-70, +50),
 							(+70, +50),
 							(+70, -50),
 							(-70, -50)]
 	
-	def __init__(self, world, boundary = None):		
+	# tolerance: see optimize_chains (None: the boundary is used as it is);
+	# prepared: the boundary is the output of Wall.prepare
+	def __init__(self, world, boundary = None, tolerance = 0.01, prepared = False):		
 		self.world = world
 		
 		self.boundary = boundary
-		if self.boundary is None:
-			self.boundary = Wall.__default_boundary
+		if not prepared:
+			self.boundary = Wall.prepare(boundary, tolerance)
 		
 		self.b2body = world.b2world.CreateStaticBody(position=(0, 20))
-		self.b2body.CreateEdgeChain( self.boundary)
+		create_edges( self.b2body, self.boundary)
 		
 
+	@staticmethod
+	def prepare(boundary = None, tolerance = 0.01):
+		# optimized and validated boundary (see scene.py)
+		if boundary is None:
+			boundary = Wall.__default_boundary
+		if tolerance is not None:
+			chains = optimize_chains([boundary], tolerance)
+			boundary = chains[0] if chains else boundary[:1]
+		return validate_chain(boundary)
+
 	def step(self, fw):
 		pass
 
@@ -79,6 +371,8 @@ class Ball():
 	
 
 class Maze():
+	is_static = True
+
 	__default_boundaries = [
 					[(51,-50),(51,-9),(49,-9),(49,-50),(51,-50)],
 					[(-11,-50),(-11,-29),(29,-29),(29,-9),(31,-9),(31,-31),(-9,-31),(-9,-50),(-11,-50)],
@@ -90,26 +384,55 @@ class Maze():
 					]
 	
 	
-	def __init__(self, world, boundaries = None):		
+	# boundaries, start_line and end_line are given unscaled; tolerance: see
+	# optimize_chains; prepared: they are the output of Maze.prepare
+	def __init__(self, world, boundaries = None, scale_ratio = 1.5, start_line = None, end_line = None, tolerance = 0.01, prepared = False):		
 		self.world = world
-		self.scale_ratio = 1.5
+		self.scale_ratio = scale_ratio
 
-		
+		if not prepared:
+			boundaries, start_line, end_line = Maze.prepare(boundaries, scale_ratio, start_line, end_line, tolerance)
 		self.boundaries = boundaries
-		if self.boundaries is None:
-			self.boundaries = Maze.__default_boundaries
-		
-		for w_i, wall in enumerate(self.boundaries):
-			self.boundaries[w_i] = (np.array(wall)*self.scale_ratio).astype(int).tolist()
-			
-		self.start_line = [b2Vec2(self.boundaries[5][3])+b2Vec2([-19,+25])*self.scale_ratio,
-							b2Vec2(self.boundaries[5][3])+b2Vec2([0,+25])*self.scale_ratio]
-		self.end_line = [self.boundaries[4][5],
-							b2Vec2(self.boundaries[4][5])+b2Vec2([0,17])*self.scale_ratio ]
+		self.start_line = start_line
+		self.end_line = end_line
 		
 		self.b2body = world.b2world.CreateStaticBody(position=(0, 20))
 		for boundary in self.boundaries:
-			self.b2body.CreateEdgeChain( boundary )		
+			create_edges( self.b2body, boundary )
+
+	@staticmethod
+	def prepare(boundaries = None, scale_ratio = 1.5, start_line = None, end_line = None, tolerance = 0.01):
+		# scaled (integer), optimized and validated boundaries, start and
+		# end lines; the lines default to those of the default maze
+		if boundaries is None:
+			boundaries = Maze.__default_boundaries
+
+		# scaled copies: the default (or given) boundaries are left untouched
+		boundaries = [(np.array(wall)*scale_ratio).astype(int).tolist() for wall in boundaries]
+
+		if start_line is None:
+			# next to the corners of the default maze, none for other mazes
+			if len(boundaries) > 5:
+				start_line = [b2Vec2(boundaries[5][3])+b2Vec2([-19,+25])*scale_ratio,
+								b2Vec2(boundaries[5][3])+b2Vec2([0,+25])*scale_ratio]
+			else:
+				start_line = []
+		else:
+			start_line = [b2Vec2(p)*scale_ratio for p in start_line]
+
+		if end_line is None:
+			if len(boundaries) > 4:
+				end_line = [boundaries[4][5],
+							b2Vec2(boundaries[4][5])+b2Vec2([0,17])*scale_ratio ]
+			else:
+				end_line = []
+		else:
+			end_line = [b2Vec2(p)*scale_ratio for p in end_line]
+
+		if tolerance is not None:
+			boundaries = optimize_chains(boundaries, tolerance)
+		boundaries = [validate_chain(wall) for wall in boundaries]
+		return boundaries, [(float(p[0]), float(p[1])) for p in start_line], [(float(p[0]), float(p[1])) for p in end_line]
 
 	def step(self, fw):
 		pass
@@ -121,12 +444,13 @@ class Maze():
 			fw.DrawPolygon( vertices, (255, 255, 255, 255))
 			
 
-		vertices = [transform * v for v in self.start_line]
-		fw.DrawPolygon( vertices, (0, 255, 128, 255))
-		
+		if self.start_line:
+			vertices = [transform * v for v in self.start_line]
+			fw.DrawPolygon( vertices, (0, 255, 128, 255))
 		
-		vertices = [transform * v for v in self.end_line]
-		fw.DrawPolygon( vertices, (0, 255, 0, 255))
+		if self.end_line:
+			vertices = [transform * v for v in self.end_line]
+			fw.DrawPolygon( vertices, (0, 255, 0, 255))
 
 
 			
\ No newline at end of file